@@ -0,0 +1,77 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+"""
+Startup-time benchmark.
+Each scenario runs in a fresh interpreter and reports its wall-clock time
+and peak RSS, so the cold start of the API and the cost of the heavy
+analytics imports can be tracked over time.
+
+    python benchmarks/bench_startup.py --runs 5 --json bench_output.json
+"""
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Each snippet is timed inside the child process, after interpreter start-up
+SCENARIOS = {
+    "import main": "import main",
+    "import main + warm-up": "import main\nfrom statistics.warmup import warm_up\nwarm_up()",
+    "import pandas": "import pandas",
+    "import prophet": "from prophet import Prophet",
+    "prophet backend": "from prophet import Prophet\nProphet()",
+}
+
+PROBE = """
+import resource, sys, time
+started = time.perf_counter()
+exec(compile({code!r}, "<scenario>", "exec"))
+elapsed = time.perf_counter() - started
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, file=sys.__stdout__)
+"""
+
+
+def run_scenario(code: str, runs: int):
+    """Run one scenario `runs` times in fresh interpreters."""
+    timings, rss = [], []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE.format(code=code)],
+            cwd=ROOT,
+            env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip().splitlines()[-1]
+        elapsed, max_rss = output.split()
+        timings.append(float(elapsed))
+        rss.append(int(max_rss))
+    timings.sort()
+    return {
+        "median_seconds": timings[len(timings) // 2],
+        "min_seconds": timings[0],
+        "max_rss_mb": max(rss) / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold start and import cost.")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh interpreters per scenario")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for name, code in SCENARIOS.items():
+        results[name] = run_scenario(code, args.runs)
+        r = results[name]
+        print(f"{name:<24} median {r['median_seconds']:.3f}s  min {r['min_seconds']:.3f}s  rss {r['max_rss_mb']:.0f} MB")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,15 +5,73 @@ from routers import tally  # <-- Import the new tally router
 from routers import forecast # for forecast the sales
 from routers import sales_prediction
 from database import engine, Base
+from services.events import relay_events
+from services.partitioning import setup_storage
+from services.search import setup_search_index
+from services.tally import close_clients
+from statistics import model_store
+from statistics import snapshot
+from statistics.warmup import WARMUP_ENABLED, warm_up
+from statistics.workers import shutdown_process_pool
+import asyncio
+import os
 
 
 app = FastAPI()
 
-# Create tables on startup
-@app.on_event("startup")
-async def init_db():
+async def setup_schema():
+    """Create the tables, partitions and search index if they are missing."""
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await setup_storage(conn)
+        await setup_search_index(conn)
+
+# Create tables on startup, unless serve.py already did before starting its workers
+@app.on_event("startup")
+async def init_db():
+    if os.getenv("SCHEMA_READY") != "1":
+        await setup_schema()
+
+# Train a first forecast model if none is stored and schedule the nightly refit.
+# A stored model is loaded lazily on the first prediction (or by the warm-up).
+@app.on_event("startup")
+async def init_forecast_model():
+    if not model_store.MODEL_PATH.exists():
+        app.state.initial_refit = asyncio.create_task(model_store.refit_initial())
+    app.state.model_refit = asyncio.create_task(model_store.refit_nightly())
+
+# Forward change feed events published by the other server workers
+@app.on_event("startup")
+async def start_event_relay():
+    app.state.event_relay = asyncio.create_task(relay_events())
+
+# Optionally build the in-memory invoice snapshot used by the analytics
+@app.on_event("startup")
+async def load_invoice_snapshot():
+    if snapshot.SNAPSHOT_ENABLED:
+        app.state.snapshot = asyncio.create_task(snapshot.load())
+
+# Optionally load pandas/Prophet in the background instead of on first use
+@app.on_event("startup")
+async def warm_up_analytics():
+    if WARMUP_ENABLED:
+        app.state.warmup = asyncio.create_task(asyncio.to_thread(warm_up))
+
+@app.on_event("shutdown")
+async def stop_forecast_model():
+    app.state.model_refit.cancel()
+
+@app.on_event("shutdown")
+async def stop_event_relay():
+    app.state.event_relay.cancel()
+
+@app.on_event("shutdown")
+async def stop_process_pool():
+    shutdown_process_pool()
+
+@app.on_event("shutdown")
+async def close_tally_clients():
+    await close_clients()
 
 
 # Optional CORS config
@@ -1,9 +1,7 @@
 from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Enum, func
-from sqlalchemy.orm import declarative_base
 import enum
 from datetime import datetime
-
-Base = declarative_base()
+from database import Base
 
 # SQLAlchemy Enum class that matches the Pydantic Enum
 class InvoiceStatus(enum.Enum):
@@ -15,12 +13,14 @@ class InvoiceStatus(enum.Enum):
 
 class Invoice(Base):
     __tablename__ = "invoices"
+    # Never reuse the ids of invoices moved to the SQLite archive table
+    __table_args__ = {"sqlite_autoincrement": True}
 
     id = Column(Integer, primary_key=True, index=True)
     company_name = Column(String, nullable=False)
     buyer_details = Column(String, nullable=False)
     invoice_no = Column(String, unique=True, nullable=False)
-    invoice_date = Column(Date, nullable=False)
+    invoice_date = Column(Date, nullable=False, index=True)
     vehicle_number = Column(String, nullable=False)
     description = Column(String, nullable=False)
     hsn_sac = Column(String, nullable=False)
@@ -32,4 +32,13 @@ class Invoice(Base):
     gstin = Column(String, nullable=False)
     status = Column(Enum(InvoiceStatus), default=InvoiceStatus.DRAFT, nullable=False)
     created_at = Column(DateTime, default=func.now())
-    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
\ No newline at end of file
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+# Closed financial years moved to archive storage (see services/partitioning.py)
+class InvoiceArchive(Base):
+    __tablename__ = "invoice_archives"
+
+    fy_start = Column(Date, primary_key=True)
+    fy_end = Column(Date, nullable=False)
+    row_count = Column(Integer, nullable=False)
+    archived_at = Column(DateTime, default=func.now())
@@ -1,6 +1,10 @@
-from fastapi import Depends, APIRouter
+from datetime import date
+from typing import Optional
+
+from fastapi import Depends, APIRouter, Query
 from database import get_db
 from sqlalchemy.ext.asyncio import AsyncSession
+from services.shared_cache import cached
 from statistics.analytics import (get_weekly_revenue,
                                   get_monthly_revenue,
                                   get_quarterly_revenue,
@@ -12,46 +16,68 @@ router = APIRouter()
 """
 This module contains routes for analytics related to sales and revenue.
 It includes routes to get weekly, monthly, and quarterly revenue,
-as well as the top sold items and top revenue items."""
+as well as the top sold items and top revenue items.
+Results are kept in the shared cache until the next invoice write, so
+every server worker reuses them."""
 
 #Routing for the weekly revenue
 @router.get("/analytics/-weekly-revenue")
-async def weekly_revenue(db: AsyncSession = Depends(get_db)):
+async def weekly_revenue(
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    db: AsyncSession = Depends(get_db)
+):
     """
     Returns the weekly revenue.
     """
-    return await get_weekly_revenue(db)
+    return await cached(f"analytics:weekly-revenue:{from_date}:{to_date}", lambda: get_weekly_revenue(db, from_date, to_date))
 
 #Routing for the monthly revenue
 @router.get("/analytics/monthly-revenue")
-async def monthly_revenue(db: AsyncSession = Depends(get_db)):
+async def monthly_revenue(
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    db: AsyncSession = Depends(get_db)
+):
     """
     Returns the monthly revenue.
     """
-    return await get_monthly_revenue(db)
+    return await cached(f"analytics:monthly-revenue:{from_date}:{to_date}", lambda: get_monthly_revenue(db, from_date, to_date))
 
 #Routing for the quarterly revenue
 @router.get("/analytics/quarterly-revenue")
-async def quarterly_revenue(db: AsyncSession = Depends(get_db)):
+async def quarterly_revenue(
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    db: AsyncSession = Depends(get_db)
+):
     """
     Returns the quarterly revenue."""
-    return await get_quarterly_revenue(db)
+    return await cached(f"analytics:quarterly-revenue:{from_date}:{to_date}", lambda: get_quarterly_revenue(db, from_date, to_date))
 
 #Routing for the top sold items
 @router.get("/analytics/top-sold")
-async def top_sold(session=Depends(get_db)):
+async def top_sold(
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    session=Depends(get_db)
+):
     """
     Returns the top 5 sold items.
     """
-    return await top_sold_items(session)
+    return await cached(f"analytics:top-sold:{from_date}:{to_date}", lambda: top_sold_items(session, from_date, to_date))
 
 #Routing for the top revenue items
 @router.get("/analytics/top-products")
-async def top_products(session=Depends(get_db)):
+async def top_products(
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    session=Depends(get_db)
+):
     """
     Returns the top 5 products by revenue.
     """
-    return await top_revenue_items(session)
+    return await cached(f"analytics:top-products:{from_date}:{to_date}", lambda: top_revenue_items(session, from_date, to_date))
 
 
 
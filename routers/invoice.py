@@ -1,14 +1,60 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import update, delete
 from sqlalchemy.future import select
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy.exc import DBAPIError, IntegrityError
 from database import get_db
 from models.invoice import Invoice as InvoiceModel, InvoiceStatus
-from schemas.invoice import Invoice, InvoiceCreate, InvoiceUpdate, InvoiceStatusEnum
+from schemas.invoice import Invoice, InvoiceCreate, InvoiceUpdate, InvoiceStatusEnum, InvoiceBulkStatusUpdate, InvoiceFileFormat
+from services.events import publish, revenue_delta, stream_events
+from services.invoice_export import build_export_query, stream_csv, stream_parquet
+from services.invoice_import import ImportFileError, import_invoices
+from services.partitioning import get_archived_invoice, invoice_source, is_archived_write
+from services.search import search_invoices
+from statistics.snapshot import record_changed, record_deleted, record_invoices
+from datetime import date
 from typing import List, Optional
 
 router = APIRouter()
 
+ARCHIVED_DETAIL = "Invoice belongs to an archived financial year and is read-only."
+
+async def _not_found(db: AsyncSession, invoice_id: int):
+    # Invoices moved to the SQLite archive table still exist, but cannot change
+    if await get_archived_invoice(db, invoice_id):
+        raise HTTPException(status_code=400, detail=ARCHIVED_DETAIL)
+    raise HTTPException(status_code=404, detail="Invoice not found")
+
+async def _update_returning_previous(db: AsyncSession, invoice_id: int, values: dict):
+    """Update an invoice and return (invoice, old invoice_date, old amount), or None if missing."""
+    old = select(InvoiceModel.id, InvoiceModel.invoice_date, InvoiceModel.amount).where(InvoiceModel.id == invoice_id)
+    stmt = update(InvoiceModel).values(**values).execution_options(synchronize_session=False)
+    if db.bind.dialect.name == "postgresql":
+        # One statement: the old values come from a locked FROM subquery
+        old = old.with_for_update().subquery("old")
+        result = await db.execute(
+            stmt.where(InvoiceModel.id == old.c.id).returning(InvoiceModel, old.c.invoice_date, old.c.amount)
+        )
+        return result.first()
+    # SQLite cannot return FROM columns, and the driver runs the SELECT outside
+    # any transaction. The UPDATE only applies if the row still holds the values
+    # read, so a write committed in between makes it retry with fresh values.
+    stmt = stmt.where(InvoiceModel.id == invoice_id).returning(InvoiceModel)
+    if "amount" not in values and "invoice_date" not in values:
+        invoice = (await db.execute(stmt)).scalars().first()
+        return invoice and (invoice, invoice.invoice_date, invoice.amount)
+    while True:
+        previous = (await db.execute(old)).first()
+        if previous is None:
+            return None
+        result = await db.execute(
+            stmt.where(InvoiceModel.amount == previous.amount, InvoiceModel.invoice_date == previous.invoice_date)
+        )
+        invoice = result.scalars().first()
+        if invoice is not None:
+            return invoice, previous.invoice_date, previous.amount
+
 @router.post("/", response_model=Invoice)
 async def create_invoice(invoice: InvoiceCreate, db: AsyncSession = Depends(get_db)):
     # Convert pydantic enum to SQLAlchemy enum if needed
@@ -21,58 +67,208 @@ async def create_invoice(invoice: InvoiceCreate, db: AsyncSession = Depends(get_
         db.add(db_invoice)
         await db.commit()
         await db.refresh(db_invoice)
-        return db_invoice
     except IntegrityError:
         await db.rollback()
         raise HTTPException(status_code=400, detail="Invoice number already exists.")
+    generation = await publish("invoice.created", {
+        "invoice": db_invoice,
+        "revenue": revenue_delta([(db_invoice.invoice_date, db_invoice.amount)]),
+    })
+    record_invoices(generation, [db_invoice])
+    return db_invoice
+
+@router.post("/import")
+async def import_invoice_file(
+    file: UploadFile = File(...),
+    format: Optional[InvoiceFileFormat] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Bulk-import invoices from a CSV or Parquet upload, read and validated
+    in chunks. Returns the number of inserted rows and the rejected rows.
+    If the file becomes unreadable after some chunks were imported, the
+    report also carries the error and the first row not imported.
+    """
+    if format is None:
+        suffix = (file.filename or "").rsplit(".", 1)[-1].lower()
+        format = InvoiceFileFormat.PARQUET if suffix == "parquet" else InvoiceFileFormat.CSV
+    try:
+        return await import_invoices(db, file.file, format.value)
+    except ImportFileError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/")
 async def get_all_invoices(
     status: Optional[InvoiceStatusEnum] = None,
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
     db: AsyncSession = Depends(get_db)
 ):
-    query = select(InvoiceModel)
+    # Archived financial years are only read when the range reaches them
+    source = await invoice_source(db, from_date, to_date)
+    query = select(*source)
     
-    # Filter by status if provided
+    # Filter by status and date range if provided
     if status:
-        query = query.where(InvoiceModel.status == InvoiceStatus[status.name])
+        query = query.where(source.status == InvoiceStatus[status.name])
+    if from_date:
+        query = query.where(source.invoice_date >= from_date)
+    if to_date:
+        query = query.where(source.invoice_date <= to_date)
     
     result = await db.execute(query)
-    invoices = result.scalars().all()
+    invoices = result.mappings().all()
     return invoices
 
+@router.get("/search")
+async def search(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Full-text search over invoice number, company, buyer and description.
+    Every word is matched as a prefix; results are ranked best match first.
+    """
+    invoices = await search_invoices(db, q, limit + 1, offset)
+    return {
+        "results": invoices[:limit],
+        "limit": limit,
+        "offset": offset,
+        "has_more": len(invoices) > limit,
+    }
+
+@router.get("/events")
+async def invoice_events():
+    """
+    Server-sent events for invoice creates, updates, status changes, deletes
+    and imports, with the resulting weekly, monthly and quarterly revenue
+    deltas. A `resync` event means the client fell behind and should re-query.
+    """
+    return StreamingResponse(
+        stream_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/export")
+async def export_invoices(
+    format: InvoiceFileFormat = InvoiceFileFormat.CSV,
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    status: Optional[InvoiceStatusEnum] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Stream invoices as CSV or Parquet, fetched from the database in chunks.
+    """
+    source = await invoice_source(db, from_date, to_date)
+    query = build_export_query(source, from_date, to_date, InvoiceStatus[status.name] if status else None)
+    if format == InvoiceFileFormat.PARQUET:
+        body, media_type = stream_parquet(query), "application/vnd.apache.parquet"
+    else:
+        body, media_type = stream_csv(query), "text/csv"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=invoices.{format.value}"}
+    )
+
 @router.get("/{invoice_id}")
 async def get_invoice(invoice_id: int, db: AsyncSession = Depends(get_db)):
     result = await db.execute(select(InvoiceModel).where(InvoiceModel.id == invoice_id))
     invoice = result.scalars().first()
+    if not invoice:
+        # Fall back to the SQLite archive table
+        invoice = await get_archived_invoice(db, invoice_id)
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     return invoice
 
+@router.patch("/status")
+async def bulk_update_invoice_status(
+    payload: InvoiceBulkStatusUpdate,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Move every invoice matching the given ids and/or filter to a new status
+    in a single UPDATE statement.
+    """
+    conditions = []
+    if payload.ids is not None:
+        conditions.append(InvoiceModel.id.in_(payload.ids))
+    if payload.filter is not None:
+        criteria = payload.filter
+        if criteria.status:
+            conditions.append(InvoiceModel.status == InvoiceStatus[criteria.status.name])
+        if criteria.company_name:
+            conditions.append(InvoiceModel.company_name == criteria.company_name)
+        if criteria.from_date:
+            conditions.append(InvoiceModel.invoice_date >= criteria.from_date)
+        if criteria.to_date:
+            conditions.append(InvoiceModel.invoice_date <= criteria.to_date)
+
+    # Refuse to touch the whole table by accident
+    if not conditions:
+        raise HTTPException(status_code=400, detail="Provide invoice ids or a filter.")
+
+    stmt = (
+        update(InvoiceModel)
+        .where(*conditions)
+        .values(status=InvoiceStatus[payload.status.name])
+        .returning(InvoiceModel.id)
+        .execution_options(synchronize_session=False)
+    )
+    try:
+        result = await db.execute(stmt)
+        updated_ids = result.scalars().all()
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Status update failed.")
+    except DBAPIError as e:
+        await db.rollback()
+        if is_archived_write(e):
+            raise HTTPException(status_code=400, detail="The filter matches invoices of an archived financial year.")
+        raise
+    if updated_ids:
+        generation = await publish("invoice.status_bulk", {"status": payload.status, "ids": updated_ids})
+        record_changed(generation, updated_ids)
+    return {"updated": len(updated_ids), "ids": updated_ids}
+
 @router.put("/{invoice_id}")
 async def update_invoice(invoice_id: int, updated: InvoiceUpdate, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(InvoiceModel).where(InvoiceModel.id == invoice_id))
-    invoice = result.scalars().first()
-    if not invoice:
-        raise HTTPException(status_code=404, detail="Invoice not found")
-    
     update_data = updated.dict(exclude_unset=True)
     
     # Convert status enum if present
     if "status" in update_data and update_data["status"]:
         update_data["status"] = InvoiceStatus[update_data["status"].name]
     
-    for key, value in update_data.items():
-        if value is not None:  # Only update fields that were actually provided
-            setattr(invoice, key, value)
+    # Only update fields that were actually provided
+    values = {key: value for key, value in update_data.items() if value is not None}
+    if not values:
+        return await get_invoice(invoice_id, db)
     
     try:
+        # The revenue delta needs the old amount and date
+        row = await _update_returning_previous(db, invoice_id, values)
         await db.commit()
-        await db.refresh(invoice)
-        return invoice
     except IntegrityError:
         await db.rollback()
         raise HTTPException(status_code=400, detail="Invoice update failed.")
+    except DBAPIError as e:
+        await db.rollback()
+        if is_archived_write(e):
+            raise HTTPException(status_code=400, detail=ARCHIVED_DETAIL)
+        raise
+    if row is None:
+        await _not_found(db, invoice_id)
+    invoice, previous_date, previous_amount = row
+    changes = [(previous_date, -previous_amount), (invoice.invoice_date, invoice.amount)]
+    generation = await publish("invoice.updated", {"invoice": invoice, "revenue": revenue_delta(changes)})
+    record_changed(generation, [invoice.id])
+    return invoice
 
 @router.patch("/{invoice_id}/status")
 async def update_invoice_status(
@@ -80,29 +276,54 @@ async def update_invoice_status(
     status: InvoiceStatusEnum,
     db: AsyncSession = Depends(get_db)
 ):
-    result = await db.execute(select(InvoiceModel).where(InvoiceModel.id == invoice_id))
-    invoice = result.scalars().first()
-    if not invoice:
-        raise HTTPException(status_code=404, detail="Invoice not found")
-    
     # Convert pydantic enum to SQLAlchemy enum
-    invoice.status = InvoiceStatus[status.name]
-    
+    stmt = (
+        update(InvoiceModel)
+        .where(InvoiceModel.id == invoice_id)
+        .values(status=InvoiceStatus[status.name])
+        .returning(InvoiceModel)
+        .execution_options(synchronize_session=False)
+    )
     try:
+        result = await db.execute(stmt)
+        invoice = result.scalars().first()
         await db.commit()
-        await db.refresh(invoice)
-        return invoice
     except IntegrityError:
         await db.rollback()
         raise HTTPException(status_code=400, detail="Status update failed.")
+    except DBAPIError as e:
+        await db.rollback()
+        if is_archived_write(e):
+            raise HTTPException(status_code=400, detail=ARCHIVED_DETAIL)
+        raise
+    if not invoice:
+        await _not_found(db, invoice_id)
+    generation = await publish("invoice.status", {"invoice": invoice})
+    record_changed(generation, [invoice.id])
+    return invoice
 
 @router.delete("/{invoice_id}")
 async def delete_invoice(invoice_id: int, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(InvoiceModel).where(InvoiceModel.id == invoice_id))
-    invoice = result.scalars().first()
-    if not invoice:
-        raise HTTPException(status_code=404, detail="Invoice not found")
-    
-    await db.delete(invoice)
-    await db.commit()
-    return {"detail": "Invoice deleted"}
\ No newline at end of file
+    stmt = (
+        delete(InvoiceModel)
+        .where(InvoiceModel.id == invoice_id)
+        .returning(InvoiceModel.id, InvoiceModel.invoice_date, InvoiceModel.amount)
+        .execution_options(synchronize_session=False)
+    )
+    try:
+        result = await db.execute(stmt)
+        deleted = result.first()
+        await db.commit()
+    except DBAPIError as e:
+        await db.rollback()
+        if is_archived_write(e):
+            raise HTTPException(status_code=400, detail=ARCHIVED_DETAIL)
+        raise
+    if deleted is None:
+        await _not_found(db, invoice_id)
+    generation = await publish("invoice.deleted", {
+        "id": deleted.id,
+        "revenue": revenue_delta([(deleted.invoice_date, -deleted.amount)]),
+    })
+    record_deleted(generation, [deleted.id])
+    return {"detail": "Invoice deleted"}
@@ -1,40 +1,142 @@
-from fastapi import Depends, APIRouter
+import asyncio
+from typing import List, Optional
+from fastapi import Depends, APIRouter, BackgroundTasks, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from database import get_db
 from sqlalchemy.ext.asyncio import AsyncSession
+from schemas.forecast import BacktestConfig, ForecastEngine, SegmentDimension
+from services.shared_cache import cached
+from statistics import model_store
 from statistics.analytics import (get_invoice_date_amount_df,
-                                  forecast)
+                                  forecast,
+                                  compare_engines)
 
 router = APIRouter()
 
 
 """
-This module contains routes for sales prediction using the Prophet library.
-It includes routes to predict sales for the next day, week, and month."""
+This module contains routes for sales prediction.
+It includes routes to predict sales for the next day, week, and month,
+using either the stored Prophet model or the fast Holt-Winters engine
+(`?engine=fast`) and per-segment forecasts fitted in parallel.
+Prophet predictions use the model refitted nightly by `model_store`;
+nothing under /predict refits Prophet on the request path. The evaluation
+routes (/compare and /backtest) do fit models, always in the shared
+process pool so the event loop is never blocked. Predictions, comparisons and
+backtests are kept in the shared cache, so every server worker reuses
+them until the next invoice write (or model refit)."""
+
+
+async def predict_sales(session, days: int, engine: ForecastEngine):
+    """Predict `days` days of sales with the requested engine."""
+    if engine == ForecastEngine.FAST:
+        async def fit_and_forecast():
+            df = await get_invoice_date_amount_df(session)
+            return await forecast(df, days, engine.value)
+        return await cached(f"predict:fast:{days}", fit_and_forecast)
+    try:
+        return await cached(
+            f"predict:prophet:{days}:{model_store.model_version()}",
+            lambda: asyncio.to_thread(model_store.predict, days)
+        )
+    except model_store.ModelNotReady as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
 
 # Route the predict the sales for the next day
 @router.get("/predict/day")
-async def predict_day(session=Depends(get_db)):
+async def predict_day(engine: ForecastEngine = ForecastEngine.PROPHET, session=Depends(get_db)):
     """
     Predict the sales for the next day.
     """
-    df = await get_invoice_date_amount_df(session)
-    return await forecast(df, 1)
+    return await predict_sales(session, 1, engine)
 
 
 # Route the predict the sales for the next week
 @router.get("/predict/week")
-async def predict_week(session=Depends(get_db)):
+async def predict_week(engine: ForecastEngine = ForecastEngine.PROPHET, session=Depends(get_db)):
     """
     Predict the sales for the next week.
     """
-    df = await get_invoice_date_amount_df(session)
-    return await forecast(df, 7)
+    return await predict_sales(session, 7, engine)
 
 
 # Route the predict the sales for the next month
 @router.get("/predict/month")
-async def predict_month(session=Depends(get_db)):
+async def predict_month(engine: ForecastEngine = ForecastEngine.PROPHET, session=Depends(get_db)):
     """
     Predict the sales for the next month."""
-    df = await get_invoice_date_amount_df(session)
-    return await forecast(df, 30)
\ No newline at end of file
+    return await predict_sales(session, 30, engine)
+
+
+# Route to predict the sales of every segment (HSN/SAC code, company or item)
+@router.get("/predict/segments")
+async def predict_segments(
+    dimension: SegmentDimension = SegmentDimension.HSN_SAC,
+    days: int = Query(7, ge=1, le=90),
+    engine: ForecastEngine = ForecastEngine.FAST,
+    min_history: int = Query(30, ge=2, description="Days of sales needed to use Prophet"),
+    top: Optional[int] = Query(None, ge=1, description="Only forecast the top N segments by revenue"),
+    session=Depends(get_db)
+):
+    """
+    Predict the sales of each segment, one model per segment fitted in
+    parallel. Results are streamed as NDJSON lines in completion order.
+    Every segment forecasts the same window, the `days` days after the
+    latest invoice (`forecast_from`..`forecast_to` on each line).
+    """
+    from statistics.segments import last_sale_date, load_segment_series, stream_segment_forecasts
+    series = await load_segment_series(session, dimension.value, top)
+    history_end = await last_sale_date(session)
+    return StreamingResponse(
+        stream_segment_forecasts(series, days, engine.value, min_history, history_end),
+        media_type="application/x-ndjson"
+    )
+
+
+# Route to compare the accuracy of the forecasting engines (evaluation, fits both)
+@router.get("/compare")
+async def compare(days: int = Query(7, ge=1, le=90), session=Depends(get_db)):
+    """
+    Compare the fast engine against Prophet on the last `days` days of history.
+    Both engines are fitted on the spot, in the process pool; for a more
+    thorough comparison use /backtest.
+    """
+    async def compare_history():
+        df = await get_invoice_date_amount_df(session)
+        return await compare_engines(df, days)
+    return await cached(f"compare:{days}", compare_history)
+
+
+# Route to backtest the forecasting configurations with rolling-origin cross-validation
+@router.get("/backtest")
+async def backtest(
+    initial: int = Query(180, ge=14, description="Days of history before the first cutoff"),
+    period: int = Query(30, ge=1, description="Days between cutoffs"),
+    horizon: int = Query(30, ge=1, le=90, description="Days forecast at each cutoff"),
+    configs: Optional[List[BacktestConfig]] = Query(None, description="Configurations to test (all by default)"),
+    max_folds: int = Query(12, ge=1, le=60, description="Only use the latest N cutoffs"),
+    session=Depends(get_db)
+):
+    """
+    Report MAE/MAPE per horizon day and fit time for each forecasting
+    configuration, with folds fitted in parallel in the process pool.
+    """
+    from statistics.backtest import run_backtest
+    config_names = [config.value for config in configs] if configs else None
+
+    async def backtest_history():
+        df = await get_invoice_date_amount_df(session)
+        return await run_backtest(df, initial, period, horizon, config_names, max_folds)
+    return await cached(f"backtest:{initial}:{period}:{horizon}:{config_names}:{max_folds}", backtest_history)
+
+
+
+# Route to refit the stored Prophet model outside the nightly schedule
+@router.post("/model/refit", status_code=202)
+async def refit_model(background_tasks: BackgroundTasks):
+    """
+    Schedule a background refit of the stored Prophet model.
+    """
+    background_tasks.add_task(model_store.refit)
+    return {"detail": "Model refit scheduled"}
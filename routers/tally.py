@@ -1,17 +1,27 @@
-from fastapi import APIRouter, HTTPException, Query
-from datetime import datetime, timedelta
+from fastapi import APIRouter, Depends, HTTPException, Query
+from datetime import date, datetime, timedelta
+import asyncio
 import httpx
 import xml.etree.ElementTree as ET
 from typing import Optional, List
 import logging
 from pydantic import BaseModel
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db
+from models.invoice import InvoiceStatus
+from schemas.invoice import InvoiceStatusEnum
+from services.events import publish
+from services.partitioning import is_archived_write
+from services.reconcile import (build_voucher_request, load_local_invoices, parse_vouchers,
+                                reconcile_frames, update_matched_status)
+from services.tally import UnknownTarget, fan_out, gateway_targets, get_targets, post
+from statistics.snapshot import record_changed
 
 router = APIRouter()
 
-# Configuration
-TALLY_URL = "http://100.83.110.70:9000/"  # Adjust if necessary
-# TALLY_URL = "http://localhost:9000"  # Adjust if necessary
-REQUEST_TIMEOUT = 15  # seconds
+# Configuration: Tally gateways and companies are registered in services/tally.py
+TARGET_DESCRIPTION = "Only query this target (gateway or gateway/company); all targets by default"
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -28,9 +38,37 @@ class VoucherData(BaseModel):
     narration: str = ""
     ledger_entries: List[VoucherEntry]
 
+def _targets(name: Optional[str]):
+    try:
+        return get_targets(name)
+    except UnknownTarget:
+        raise HTTPException(status_code=404, detail=f"Unknown Tally target: {name}")
+
+def _single_target(name: Optional[str]):
+    targets = _targets(name)
+    if len(targets) > 1:
+        raise HTTPException(status_code=400, detail="Several Tally targets are configured; choose one with `target`.")
+    return targets[0]
+
+def _check_results(results):
+    """Fail like a single Tally would when no target answered."""
+    if not any(result["ok"] for result in results):
+        errors = "; ".join(f"{result['target']}: {result['error']}" for result in results)
+        raise HTTPException(status_code=502, detail=f"Failed to query Tally: {errors}")
+
+def _summaries(results):
+    """Per-target outcome, listed next to the merged rows."""
+    return [
+        {key: result[key] for key in ("target", "company", "ok", "error") if key in result}
+        for result in results
+    ]
+
+def _collection(response):
+    return ET.fromstring(response.text).find(".//COLLECTION")
+
 @router.get("/company-name")
 async def get_company_name():
-    """Retrieve list of companies configured in Tally."""
+    """Retrieve the list of companies loaded on every configured Tally gateway."""
     xml_request = """
     <ENVELOPE>
         <HEADER>
@@ -49,58 +87,56 @@ async def get_company_name():
     </ENVELOPE>
     """
     
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                TALLY_URL, 
-                data=xml_request, 
-                timeout=REQUEST_TIMEOUT,
-                headers={"Content-Type": "text/xml"}
-            )
-            response.raise_for_status()
-    except httpx.HTTPError as e:
-        logger.error(f"Failed to connect to Tally: {e}")
-        return {"error": f"Failed to connect to Tally: {e}"}
+    results = await fan_out(gateway_targets(), xml_request, _parse_company_names)
+    _check_results(results)
+    companies = [name for result in results if result["ok"] for name in result["result"]]
+    return {
+        "company_names": list(dict.fromkeys(companies)),
+        "gateways": [
+            {"gateway": result["target"], "ok": result["ok"], "company_names": result.get("result", [])}
+            for result in results
+        ]
+    }
+
+def _parse_company_names(response):
+    root = ET.fromstring(response.text)
+    companies = []
     
-    try:
-        root = ET.fromstring(response.text)
-        companies = []
-        
-        # Primary search path - based on your working code
-        company_elements = root.findall(".//COMPANY")
-        if company_elements:
-            companies = [
-                company.find("NAME").text
-                for company in company_elements
-                if company.find("NAME") is not None
-            ]
-        
-        # Backup paths in case the structure is different
-        if not companies:
-            paths = [".//COMPANYNAME", ".//COMPANY/DATA/NAME"]
-            for path in paths:
-                elements = root.findall(path)
-                if elements:
-                    companies = [element.text for element in elements if element.text]
-                    break
-        
-        return {"company_names": companies}
-    except Exception as e:
-        logger.error(f"Failed to parse XML: {e}")
-        return {"error": f"Failed to parse XML: {e}"}
+    # Primary search path - based on your working code
+    company_elements = root.findall(".//COMPANY")
+    if company_elements:
+        companies = [
+            company.find("NAME").text
+            for company in company_elements
+            if company.find("NAME") is not None
+        ]
+    
+    # Backup paths in case the structure is different
+    if not companies:
+        paths = [".//COMPANYNAME", ".//COMPANY/DATA/NAME"]
+        for path in paths:
+            elements = root.findall(path)
+            if elements:
+                companies = [element.text for element in elements if element.text]
+                break
+    
+    return companies
 
 
 @router.get("/voucher-codes")
 async def get_voucher_codes(
     from_date: Optional[str] = Query(None, description="Start date in YYYYMMDD format"),
     to_date: Optional[str] = Query(None, description="End date in YYYYMMDD format"),
-    voucher_type: Optional[str] = Query(None, description="Type of voucher to filter")
+    voucher_type: Optional[str] = Query(None, description="Type of voucher to filter"),
+    target: Optional[str] = Query(None, description=TARGET_DESCRIPTION)
 ):
     """
-    Retrieve voucher details from Tally.
+    Retrieve voucher details from every Tally target concurrently.
+    Each voucher is labelled with the target and company it came from.
     
     If dates are not provided, defaults to current month.
     """
+    targets = _targets(target)
     # Set default date range to current month if not provided
     if not from_date or not to_date:
         today = datetime.now()
@@ -144,51 +180,41 @@ async def get_voucher_codes(
     </ENVELOPE>
     """
     
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                TALLY_URL, 
-                data=request_xml, 
-                headers={"Content-Type": "text/xml"},
-                timeout=REQUEST_TIMEOUT
-            )
-            response.raise_for_status()
-    except httpx.HTTPError as e:
-        logger.error(f"Failed to connect to Tally: {e}")
-        raise HTTPException(status_code=502, detail=f"Failed to connect to Tally: {e}")
+    results = await fan_out(targets, request_xml, _parse_voucher_codes)
+    _check_results(results)
+    vouchers = [
+        {**voucher, "target": result["target"], "company": result["company"]}
+        for result in results if result["ok"] for voucher in result["result"]
+    ]
+    return {"vouchers": vouchers, "targets": _summaries(results)}
+
+def _parse_voucher_codes(response):
+    collection = _collection(response)
+    if collection is None:
+        return []
     
-    try:
-        root = ET.fromstring(response.text)
-        collection = root.find(".//COLLECTION")
-        
-        if collection is None:
-            return {"vouchers": []}
-        
-        vouchers = []
-        for voucher in collection.findall("VOUCHER"):
-            voucher_info = {
-                "voucher_number": voucher.findtext("VOUCHERNUMBER", ""),
-                "date": voucher.findtext("DATE", ""),
-                "type": voucher.findtext("VOUCHERTYPENAME", ""),
-                "ledger": voucher.findtext("PARTYLEDGERNAME", ""),
-                "amount": voucher.findtext("AMOUNT", "0"),
-                "narration": voucher.findtext("NARRATION", ""),
-            }
-            
-            # Only add if we have at least a voucher number
-            if voucher_info["voucher_number"]:
-                vouchers.append(voucher_info)
+    vouchers = []
+    for voucher in collection.findall("VOUCHER"):
+        voucher_info = {
+            "voucher_number": voucher.findtext("VOUCHERNUMBER", ""),
+            "date": voucher.findtext("DATE", ""),
+            "type": voucher.findtext("VOUCHERTYPENAME", ""),
+            "ledger": voucher.findtext("PARTYLEDGERNAME", ""),
+            "amount": voucher.findtext("AMOUNT", "0"),
+            "narration": voucher.findtext("NARRATION", ""),
+        }
         
-        return {"vouchers": vouchers}
+        # Only add if we have at least a voucher number
+        if voucher_info["voucher_number"]:
+            vouchers.append(voucher_info)
     
-    except Exception as e:
-        logger.error(f"Error parsing XML: {e}")
-        raise HTTPException(status_code=500, detail=f"Error parsing XML: {str(e)}")
+    return vouchers
 
 
 @router.get("/ledger-masters")
-async def get_ledger_masters():
-    """Retrieve all ledger accounts from Tally."""
+async def get_ledger_masters(target: Optional[str] = Query(None, description=TARGET_DESCRIPTION)):
+    """Retrieve all ledger accounts from every Tally target concurrently."""
+    targets = _targets(target)
     # Using TDL approach which seems to work better
     request_xml = """
     <ENVELOPE>
@@ -216,49 +242,39 @@ async def get_ledger_masters():
     </ENVELOPE>
     """
     
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                TALLY_URL, 
-                data=request_xml, 
-                headers={"Content-Type": "text/xml"},
-                timeout=REQUEST_TIMEOUT
-            )
-            response.raise_for_status()
-    except httpx.HTTPError as e:
-        logger.error(f"Failed to connect to Tally: {e}")
-        raise HTTPException(status_code=502, detail=f"Failed to connect to Tally: {e}")
+    results = await fan_out(targets, request_xml, _parse_ledgers)
+    _check_results(results)
+    ledgers = [
+        {**ledger, "target": result["target"], "company": result["company"]}
+        for result in results if result["ok"] for ledger in result["result"]
+    ]
+    return {"ledgers": ledgers, "targets": _summaries(results)}
+
+def _parse_ledgers(response):
+    collection = _collection(response)
+    if collection is None:
+        return []
     
-    try:
-        root = ET.fromstring(response.text)
-        collection = root.find(".//COLLECTION")
-        
-        if collection is None:
-            return {"ledgers": []}
-        
-        ledgers = []
-        for ledger in collection.findall("LEDGER"):
-            ledger_info = {
-                "name": ledger.findtext("NAME", ""),
-                "parent": ledger.findtext("PARENT", ""),
-                "opening_balance": ledger.findtext("OPENINGBALANCE", "0"),
-                "closing_balance": ledger.findtext("CLOSINGBALANCE", "0"),
-            }
-            
-            # Only add if we have a name
-            if ledger_info["name"]:
-                ledgers.append(ledger_info)
+    ledgers = []
+    for ledger in collection.findall("LEDGER"):
+        ledger_info = {
+            "name": ledger.findtext("NAME", ""),
+            "parent": ledger.findtext("PARENT", ""),
+            "opening_balance": ledger.findtext("OPENINGBALANCE", "0"),
+            "closing_balance": ledger.findtext("CLOSINGBALANCE", "0"),
+        }
         
-        return {"ledgers": ledgers}
+        # Only add if we have a name
+        if ledger_info["name"]:
+            ledgers.append(ledger_info)
     
-    except Exception as e:
-        logger.error(f"Error parsing XML: {e}")
-        raise HTTPException(status_code=500, detail=f"Error parsing XML: {str(e)}")
+    return ledgers
 
 
 @router.get("/company-info")
-async def get_company_info():
-    """Retrieve information about the active company in Tally."""
+async def get_company_info(target: Optional[str] = Query(None, description=TARGET_DESCRIPTION)):
+    """Retrieve information about the company of every Tally target."""
+    targets = _targets(target)
     # Using TDL approach for consistency
     request_xml = """
     <ENVELOPE>
@@ -286,49 +302,44 @@ async def get_company_info():
     </ENVELOPE>
     """
     
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                TALLY_URL, 
-                data=request_xml, 
-                headers={"Content-Type": "text/xml"},
-                timeout=REQUEST_TIMEOUT
-            )
-            response.raise_for_status()
-    except httpx.HTTPError as e:
-        logger.error(f"Failed to connect to Tally: {e}")
-        raise HTTPException(status_code=502, detail=f"Failed to connect to Tally: {e}")
+    results = await fan_out(targets, request_xml, _parse_company_info)
+    _check_results(results)
+    companies = [
+        {**result["result"], "target": result["target"], "company": result["company"]}
+        for result in results if result["ok"] and result["result"]
+    ]
+    if not companies:
+        return {"error": "No company information found"}
+    return {"companies": companies, "targets": _summaries(results)}
+
+def _parse_company_info(response):
+    collection = _collection(response)
+    if collection is None:
+        return None
     
-    try:
-        root = ET.fromstring(response.text)
-        collection = root.find(".//COLLECTION")
-        
-        if collection is None:
-            return {"error": "No company information found"}
-        
-        company_element = collection.find("COMPANY")
-        if company_element is None:
-            return {"error": "No company information found"}
-        
-        return {
-            "company_name": company_element.findtext("NAME", ""),
-            "address": company_element.findtext("ADDRESS", ""),
-            "email": company_element.findtext("EMAIL", ""),
-            "phone": company_element.findtext("PHONENUMBER", ""),
-            "financial_year_start": company_element.findtext("STARTINGFROM", ""),
-            "financial_year_end": company_element.findtext("ENDINGAT", "")
-        }
+    company_element = collection.find("COMPANY")
+    if company_element is None:
+        return None
     
-    except Exception as e:
-        logger.error(f"Error parsing XML: {e}")
-        raise HTTPException(status_code=500, detail=f"Error parsing XML: {str(e)}")
+    return {
+        "company_name": company_element.findtext("NAME", ""),
+        "address": company_element.findtext("ADDRESS", ""),
+        "email": company_element.findtext("EMAIL", ""),
+        "phone": company_element.findtext("PHONENUMBER", ""),
+        "financial_year_start": company_element.findtext("STARTINGFROM", ""),
+        "financial_year_end": company_element.findtext("ENDINGAT", "")
+    }
 
 
 @router.post("/create-voucher")
-async def create_voucher(voucher_data: VoucherData):
+async def create_voucher(
+    voucher_data: VoucherData,
+    target: Optional[str] = Query(None, description="Tally target to create the voucher in; required when several are configured")
+):
     """
     Create a new voucher in Tally.
     """
+    tally_target = _single_target(target)
     # Format date in YYYYMMDD format if not already
     date_formatted = voucher_data.date
     if len(date_formatted) != 8:
@@ -395,14 +406,7 @@ async def create_voucher(voucher_data: VoucherData):
     """
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                TALLY_URL, 
-                data=request_xml, 
-                headers={"Content-Type": "text/xml"},
-                timeout=REQUEST_TIMEOUT
-            )
-            response.raise_for_status()
+        response = await post(tally_target, request_xml)
     except httpx.HTTPError as e:
         logger.error(f"Failed to connect to Tally: {e}")
         raise HTTPException(status_code=502, detail=f"Failed to connect to Tally: {e}")
@@ -427,8 +431,9 @@ async def create_voucher(voucher_data: VoucherData):
 
 
 @router.get("/system-status")
-async def get_system_status():
-    """Check if Tally is accessible and get system status."""
+async def get_system_status(target: Optional[str] = Query(None, description=TARGET_DESCRIPTION)):
+    """Check that every Tally target is accessible and get its status."""
+    targets = _targets(target)
     # Simple request to check connectivity
     request_xml = """
     <ENVELOPE>
@@ -448,26 +453,70 @@ async def get_system_status():
     </ENVELOPE>
     """
     
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                TALLY_URL, 
-                data=request_xml, 
-                headers={"Content-Type": "text/xml"},
-                timeout=5  # Shorter timeout for status check
-            )
-            response.raise_for_status()
-            
-            # If we get here, Tally is responsive
-            return {
-                "status": "online",
-                "message": "Tally is accessible",
-                "version": response.headers.get("X-Tally-Version", "Unknown")
-            }
-            
-    except Exception as e:
-        logger.error(f"Tally connection check failed: {e}")
-        return {
-            "status": "offline",
-            "message": f"Tally is not accessible: {str(e)}"
-        }
\ No newline at end of file
+    # Shorter timeout for status check
+    results = await fan_out(targets, request_xml, lambda response: response.headers.get("X-Tally-Version", "Unknown"), timeout=5)
+    statuses = [
+        {
+            "target": result["target"],
+            "company": result["company"],
+            "status": "online" if result["ok"] else "offline",
+            **({"version": result["result"]} if result["ok"] else {"message": f"Tally is not accessible: {result['error']}"})
+        }
+        for result in results
+    ]
+    online = sum(result["ok"] for result in results)
+    if online == len(results):
+        return {"status": "online", "message": "Tally is accessible", "targets": statuses}
+    return {
+        "status": "degraded" if online else "offline",
+        "message": f"{len(results) - online} of {len(results)} Tally targets are not accessible",
+        "targets": statuses
+    }
+
+
+@router.get("/reconcile")
+async def reconcile_invoices(
+    from_date: date = Query(..., alias="from"),
+    to_date: date = Query(..., alias="to"),
+    voucher_type: Optional[str] = Query("Sales", description="Only reconcile vouchers of this type"),
+    set_status: Optional[InvoiceStatusEnum] = Query(None, description="Move matched invoices to this status"),
+    target: Optional[str] = Query(None, description=TARGET_DESCRIPTION),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Reconcile local invoices against Tally vouchers for a date range.
+    invoice_no is matched to the voucher REFERENCE or VOUCHERNUMBER and the
+    amounts compared; rows are reported as matched, amount mismatch,
+    missing in Tally or missing locally. The vouchers of all targets are
+    reconciled together unless `target` picks one. With `set_status`,
+    matched invoices of archived financial years keep their status.
+    """
+    if from_date > to_date:
+        raise HTTPException(status_code=400, detail="from must not be after to")
+
+    results = await fan_out(
+        _targets(target),
+        build_voucher_request(from_date, to_date),
+        lambda response: parse_vouchers(response.text, voucher_type)
+    )
+    _check_results(results)
+    vouchers = [result["result"].assign(target=result["target"]) for result in results if result["ok"]]
+
+    local = await load_local_invoices(db, from_date, to_date)
+    report = await asyncio.to_thread(reconcile_frames, local, vouchers)
+
+    if set_status:
+        status = InvoiceStatus[set_status.name]
+        matched_ids = [row["invoice_id"] for row in report["matched"]]
+        try:
+            updated_ids = await update_matched_status(db, matched_ids, status)
+        except DBAPIError as e:
+            await db.rollback()
+            if is_archived_write(e):
+                raise HTTPException(status_code=400, detail="Matched invoices belong to an archived financial year.")
+            raise
+        if updated_ids:
+            generation = await publish("invoice.status_bulk", {"status": set_status, "ids": updated_ids})
+            record_changed(generation, updated_ids)
+        report["status_updated"] = len(updated_ids)
+    return {"from": from_date, "to": to_date, "targets": _summaries(results), **report}
@@ -0,0 +1,15 @@
+from enum import Enum
+
+class ForecastEngine(str, Enum):
+    PROPHET = "prophet"
+    FAST = "fast"
+
+class SegmentDimension(str, Enum):
+    HSN_SAC = "hsn_sac"
+    COMPANY_NAME = "company_name"
+    DESCRIPTION = "description"
+
+class BacktestConfig(str, Enum):
+    FAST = "fast"
+    PROPHET = "prophet"
+    SEASONAL_NAIVE = "seasonal_naive"
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field, ConfigDict
 from datetime import date, datetime
-from typing import Optional
+from typing import List, Optional
 from enum import Enum
 
 class InvoiceStatusEnum(str, Enum):
@@ -10,6 +10,10 @@ class InvoiceStatusEnum(str, Enum):
     PAYMENT_NOT_CREDITED = "payment_not_credited"
     MONEY_NOT_YET_PROCESSED = "money_not_yet_processed"
 
+class InvoiceFileFormat(str, Enum):
+    CSV = "csv"
+    PARQUET = "parquet"
+
 class InvoiceBase(BaseModel):
     company_name: str
     buyer_details: str
@@ -44,6 +48,17 @@ class InvoiceUpdate(BaseModel):
     gstin: Optional[str] = None
     status: Optional[InvoiceStatusEnum] = None
 
+class InvoiceStatusFilter(BaseModel):
+    status: Optional[InvoiceStatusEnum] = None
+    company_name: Optional[str] = None
+    from_date: Optional[date] = None
+    to_date: Optional[date] = None
+
+class InvoiceBulkStatusUpdate(BaseModel):
+    status: InvoiceStatusEnum
+    ids: Optional[List[int]] = None
+    filter: Optional[InvoiceStatusFilter] = None
+
 class Invoice(InvoiceBase):
     id: int
     status: InvoiceStatusEnum
@@ -0,0 +1,77 @@
+import asyncio
+import math
+import os
+
+import uvicorn
+
+"""
+Production entry point: runs the API in several uvicorn worker processes.
+
+The worker count defaults to the CPUs this process may use (CPU affinity
+and the container's cgroup CPU quota), and can be set with WEB_CONCURRENCY.
+The forecasting process pool of each worker is sized so that all workers
+together use about one fitting process per CPU. Workers share analytics
+results, forecast models and change events through services/shared_cache.py.
+The database schema is set up once here, before the workers start, so they
+do not race each other creating it.
+
+    python serve.py
+"""
+
+
+def _cgroup_cpu_limit():
+    """CPUs allowed by a cgroup v2 or v1 quota, or None when unlimited."""
+    try:
+        quota, period = open("/sys/fs/cgroup/cpu.max").read().split()
+        if quota != "max":
+            return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        quota = int(open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us").read())
+        period = int(open("/sys/fs/cgroup/cpu/cpu.cfs_period_us").read())
+        if quota > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def available_cpus() -> int:
+    """Number of CPUs this process can actually run on."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS
+        cpus = os.cpu_count() or 1
+    limit = _cgroup_cpu_limit()
+    if limit:
+        cpus = min(cpus, math.ceil(limit))
+    return max(cpus, 1)
+
+
+async def _setup_schema():
+    from database import engine
+    from main import setup_schema
+    await setup_schema()
+    await engine.dispose()
+
+
+def main():
+    cpus = available_cpus()
+    workers = max(int(os.getenv("WEB_CONCURRENCY", cpus)), 1)
+    asyncio.run(_setup_schema())
+    os.environ["SCHEMA_READY"] = "1"
+    # Inherited by the workers; keeps workers x fitting processes close to the CPU count
+    os.environ.setdefault("FORECAST_WORKERS", str(max(1, cpus // workers)))
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=workers,
+        proxy_headers=True,
+        log_level=os.getenv("LOG_LEVEL", "info"),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import asyncio
+import json
+import logging
+import sqlite3
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+
+from services import shared_cache
+
+"""
+This module is the in-process change feed behind GET /invoices/events.
+Write paths call `publish` after their commit; every connected client has
+its own bounded queue, so a slow client can never hold more than
+SUBSCRIBER_QUEUE_SIZE events. When a client falls that far behind, its
+backlog is dropped and replaced by a single `resync` event telling it to
+re-query. Events are JSON-encoded once, however many clients listen.
+
+Publishing also bumps the shared data generation, so cached analytics go
+stale in every worker, and logs the event in the shared cache file, from
+which `relay_events` forwards it to the clients of the other workers. That
+write runs in a thread, so waiting for the file's lock never stalls the
+event loop.
+
+Revenue deltas are keyed the way the analytics endpoints key their
+results (week ending Sunday, month end, quarter end), so a client can add
+them straight onto the series it already holds.
+"""
+
+SUBSCRIBER_QUEUE_SIZE = 256
+HEARTBEAT_SECONDS = 15
+RELAY_INTERVAL = 0.5  # seconds between polls for other workers' events
+
+logger = logging.getLogger(__name__)
+
+_subscribers = set()
+
+
+def _period_key(day: date) -> str:
+    # Same format as the pandas Timestamp keys returned by the analytics routes
+    return datetime(day.year, day.month, day.day).isoformat()
+
+
+def period_ends(day: date):
+    """The week, month and quarter end dates `day` falls into."""
+    week_end = day + timedelta(days=6 - day.weekday())
+    quarter_month = (day.month - 1) // 3 * 3 + 3
+    next_month = date(day.year + day.month // 12, day.month % 12 + 1, 1)
+    next_quarter = date(day.year + quarter_month // 12, quarter_month % 12 + 1, 1)
+    return {
+        "weekly": week_end,
+        "monthly": next_month - timedelta(days=1),
+        "quarterly": next_quarter - timedelta(days=1),
+    }
+
+
+def revenue_delta(changes):
+    """
+    Sum (invoice_date, amount change) pairs into per-period revenue deltas,
+    leaving out periods whose total did not change.
+    """
+    totals = {"weekly": defaultdict(float), "monthly": defaultdict(float), "quarterly": defaultdict(float)}
+    for day, amount in changes:
+        for period, end in period_ends(day).items():
+            totals[period][_period_key(end)] += amount
+    return {
+        period: {key: round(value, 2) for key, value in values.items() if round(value, 2) != 0}
+        for period, values in totals.items()
+    }
+
+
+def _message(event_id, event_type: str, payload: str) -> str:
+    id_line = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{id_line}event: {event_type}\ndata: {payload}\n\n"
+
+
+def _deliver(message: str):
+    """Queue a message for every local subscriber, without ever blocking."""
+    for queue in list(_subscribers):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # The client cannot keep up: drop its backlog and ask it to re-query
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(_message(None, "resync", '{"reason":"client too slow"}'))
+
+
+async def publish(event_type: str, data):
+    """
+    Announce a committed invoice write to every worker and subscriber.
+    Returns the new data generation, or None if the shared cache failed.
+    """
+    payload = json.dumps(jsonable_encoder(data), separators=(",", ":"))
+    generation = event_id = None
+    try:
+        generation, event_id = await asyncio.to_thread(shared_cache.record_change, event_type, payload)
+    except sqlite3.Error as e:
+        logger.error(f"Failed to record {event_type} in the shared cache: {e}")
+    if _subscribers:
+        _deliver(_message(event_id, event_type, payload))
+    return generation
+
+
+async def relay_events():
+    """Background task forwarding the events published by other workers."""
+    last_id = await asyncio.to_thread(shared_cache.last_event_id)
+    while True:
+        await asyncio.sleep(RELAY_INTERVAL)
+        try:
+            events = await asyncio.to_thread(shared_cache.events_since, last_id)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to read events from the shared cache: {e}")
+            continue
+        for event_id, event_type, payload in events:
+            last_id = event_id
+            if _subscribers:
+                _deliver(_message(event_id, event_type, payload))
+
+
+async def stream_events():
+    """Yield server-sent events for one client until it disconnects."""
+    queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+    _subscribers.add(queue)
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                yield await asyncio.wait_for(queue.get(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                # Comment line; keeps proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+    finally:
+        _subscribers.discard(queue)
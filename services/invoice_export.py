@@ -0,0 +1,125 @@
+import csv
+import io
+from datetime import date, datetime
+from enum import Enum
+
+from sqlalchemy.future import select
+
+from database import AsyncSessionLocal
+from models.invoice import Invoice, InvoiceStatus
+
+"""
+This module streams invoices out of the database as CSV or Parquet.
+Rows are fetched through a server-side cursor in chunks of CHUNK_SIZE and
+each chunk is encoded and yielded on its own (one Parquet row group per
+chunk), so memory use stays flat whatever the size of the export.
+"""
+
+CHUNK_SIZE = 5000
+EXPORT_COLUMNS = [column.name for column in Invoice.__table__.columns]
+STATUS_INDEX = EXPORT_COLUMNS.index("status")
+
+
+def build_export_query(source=Invoice, from_date: date = None, to_date: date = None, status: InvoiceStatus = None):
+    """
+    Select the exported columns from `source` (the invoices entity, or the
+    columns of invoice_source() also covering archived years), filtered by
+    date range and status.
+    """
+    query = select(*[getattr(source, name) for name in EXPORT_COLUMNS]).order_by(source.invoice_date, source.id)
+    if from_date:
+        query = query.where(source.invoice_date >= from_date)
+    if to_date:
+        query = query.where(source.invoice_date <= to_date)
+    if status:
+        query = query.where(source.status == status)
+    return query
+
+
+async def _fetch_chunks(query):
+    """Yield lists of rows from a server-side cursor."""
+    # The export outlives the request's session, so it opens its own
+    async with AsyncSessionLocal() as session:
+        result = await session.stream(query.execution_options(yield_per=CHUNK_SIZE))
+        async for rows in result.partitions(CHUNK_SIZE):
+            yield rows
+
+
+def _plain(value):
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+async def stream_csv(query):
+    """Stream the query result as CSV, one chunk at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    async for rows in _fetch_chunks(query):
+        writer.writerows([_plain(value) for value in row] for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands written bytes back to the caller on drain()."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _parquet_schema():
+    import pyarrow as pa
+    types = {
+        "id": pa.int64(),
+        "invoice_date": pa.date32(),
+        "quantity": pa.float64(),
+        "rate": pa.float64(),
+        "amount": pa.float64(),
+        "created_at": pa.timestamp("us"),
+        "updated_at": pa.timestamp("us"),
+    }
+    return pa.schema([(name, types.get(name, pa.string())) for name in EXPORT_COLUMNS])
+
+
+async def stream_parquet(query):
+    """Stream the query result as a Parquet file, one row group per chunk."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _parquet_schema()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema, compression="snappy")
+    try:
+        async for rows in _fetch_chunks(query):
+            columns = [list(values) for values in zip(*rows)]
+            columns[STATUS_INDEX] = [_plain(status) for status in columns[STATUS_INDEX]]
+            arrays = [pa.array(values, type=field.type) for field, values in zip(schema, columns)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
@@ -0,0 +1,230 @@
+import asyncio
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.invoice import Invoice, InvoiceStatus
+from services.events import publish, revenue_delta
+from services.partitioning import archived_invoice_numbers
+from statistics.snapshot import COLUMNS as SNAPSHOT_COLUMNS, record_rows
+
+"""
+This module bulk-loads invoices from CSV or Parquet uploads.
+The file is read in chunks of CHUNK_SIZE rows; every chunk is validated
+with vectorized pandas checks (required fields, numbers, YYYY-MM-DD
+dates, GSTIN format and amount ~ quantity * rate) and the valid rows are inserted in
+one multi-row INSERT that skips invoice numbers already present. Rows that
+fail are collected into a rejected-rows report. Each chunk is committed
+before the next is read, so when the file turns out to be unreadable part
+way through, the report of the chunks already imported is returned with
+the error and the row the import stopped at.
+"""
+
+CHUNK_SIZE = 5000
+MAX_REPORTED_REJECTIONS = 1000
+
+TEXT_COLUMNS = [
+    "company_name", "buyer_details", "invoice_no", "vehicle_number",
+    "description", "hsn_sac", "unit", "amount_in_words", "gstin",
+]
+NUMBER_COLUMNS = ["quantity", "rate", "amount"]
+REQUIRED_COLUMNS = TEXT_COLUMNS + NUMBER_COLUMNS + ["invoice_date"]
+
+DATE_FORMAT = "%Y-%m-%d"  # one fixed format: guessing it could swap day and month
+GSTIN_PATTERN = r"\d{2}[A-Z]{5}\d{4}[A-Z][1-9A-Z]Z[0-9A-Z]"
+AMOUNT_RELATIVE_TOLERANCE = 0.005
+AMOUNT_ABSOLUTE_TOLERANCE = 1.0  # rupees, absorbs per-line rounding
+
+STATUS_BY_VALUE = {status.value: status for status in InvoiceStatus}
+
+
+class ImportFileError(ValueError):
+    """Raised when the uploaded file cannot be imported at all."""
+
+
+def iter_file_chunks(file, file_format: str):
+    """
+    Yield the uploaded file as DataFrames of at most CHUNK_SIZE rows.
+    Files that cannot be parsed raise ImportFileError.
+    """
+    import pandas as pd
+
+    if file_format == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        try:
+            parquet_file = pq.ParquetFile(file)
+            missing = set(REQUIRED_COLUMNS) - set(parquet_file.schema_arrow.names)
+            if missing:
+                raise ImportFileError(f"Missing columns: {', '.join(sorted(missing))}")
+            for batch in parquet_file.iter_batches(batch_size=CHUNK_SIZE):
+                yield batch.to_pandas()
+        except pa.ArrowException as e:
+            raise ImportFileError(f"Invalid Parquet file: {e}") from e
+        return
+
+    try:
+        reader = pd.read_csv(file, chunksize=CHUNK_SIZE, dtype=str, keep_default_na=False)
+        for index, chunk in enumerate(reader):
+            if index == 0:
+                missing = set(REQUIRED_COLUMNS) - set(chunk.columns)
+                if missing:
+                    raise ImportFileError(f"Missing columns: {', '.join(sorted(missing))}")
+            yield chunk
+    except (pd.errors.ParserError, pd.errors.EmptyDataError) as e:
+        raise ImportFileError(f"Invalid CSV file: {e}") from e
+    except UnicodeDecodeError as e:
+        raise ImportFileError("Invalid CSV file: it is not UTF-8 encoded") from e
+
+
+def validate_chunk(chunk, first_row: int):
+    """
+    Validate a chunk and split it into insertable records and rejected rows.
+    `first_row` is the 1-based data row number of the chunk's first row.
+    """
+    import numpy as np
+    import pandas as pd
+
+    chunk = chunk.reset_index(drop=True)
+    errors = {}
+
+    text = {}
+    for column in TEXT_COLUMNS:
+        text[column] = chunk[column].fillna("").astype(str).str.strip()
+        errors[f"{column} is required"] = text[column] == ""
+
+    numbers = {column: pd.to_numeric(chunk[column], errors="coerce") for column in NUMBER_COLUMNS}
+    for column, values in numbers.items():
+        errors[f"{column} is not a number"] = values.isna()
+
+    if pd.api.types.is_datetime64_any_dtype(chunk["invoice_date"]):
+        invoice_date = chunk["invoice_date"]
+    else:
+        # Parquet date columns arrive as date objects, which format as YYYY-MM-DD
+        invoice_date = pd.to_datetime(
+            chunk["invoice_date"].astype(str).str.strip(), format=DATE_FORMAT, errors="coerce"
+        )
+    errors["invoice_date is not a valid YYYY-MM-DD date"] = invoice_date.isna()
+
+    gstin = text["gstin"].str.upper()
+    errors["gstin has an invalid format"] = ~gstin.str.fullmatch(GSTIN_PATTERN).fillna(False)
+
+    expected = numbers["quantity"] * numbers["rate"]
+    matches = np.isclose(
+        numbers["amount"], expected,
+        rtol=AMOUNT_RELATIVE_TOLERANCE, atol=AMOUNT_ABSOLUTE_TOLERANCE
+    )
+    errors["amount does not match quantity * rate"] = ~matches & numbers["amount"].notna() & expected.notna()
+
+    if "status" in chunk.columns:
+        status_text = chunk["status"].fillna("").astype(str).str.strip().str.lower().replace("", InvoiceStatus.DRAFT.value)
+    else:
+        status_text = pd.Series(InvoiceStatus.DRAFT.value, index=chunk.index)
+    status = status_text.map(STATUS_BY_VALUE)
+    errors["status is not a valid invoice status"] = status.isna()
+
+    error_frame = pd.DataFrame(errors)
+    rejected_mask = error_frame.any(axis=1)
+
+    rejected = [
+        {
+            "row": first_row + int(index),
+            "invoice_no": text["invoice_no"][index],
+            "errors": [message for message, failed in error_frame.loc[index].items() if failed],
+        }
+        for index in np.flatnonzero(rejected_mask.to_numpy())
+    ]
+
+    valid = ~rejected_mask
+    valid_frame = pd.DataFrame({column: text[column][valid] for column in TEXT_COLUMNS})
+    valid_frame["gstin"] = gstin[valid]
+    for column, values in numbers.items():
+        valid_frame[column] = values[valid].astype(float)
+    valid_frame["invoice_date"] = invoice_date[valid].dt.date
+    valid_frame["status"] = status[valid]
+    rows = (valid_frame.index + first_row).tolist()
+    return valid_frame.to_dict(orient="records"), rows, rejected
+
+
+def _insert_ignoring_duplicates(dialect_name: str):
+    """INSERT that silently skips rows whose invoice_no already exists."""
+    dialect = postgresql if dialect_name == "postgresql" else sqlite
+    # invoice_no is the only unique column besides the generated id
+    return dialect.insert(Invoice).on_conflict_do_nothing().returning(Invoice.id, Invoice.invoice_no)
+
+
+async def import_invoices(db: AsyncSession, file, file_format: str):
+    """
+    Import an uploaded file chunk by chunk and return the import report.
+    Raises ImportFileError if the file is unreadable before anything was imported.
+    """
+    is_postgres = db.bind.dialect.name == "postgresql"
+    stmt = _insert_ignoring_duplicates(db.bind.dialect.name)
+    chunks = iter_file_chunks(file, file_format)
+    inserted = 0
+    rejected_count = 0
+    rejected = []
+    first_row = 1
+    error = None
+
+    while True:
+        # Parsing and validation are CPU-bound; keep them off the event loop
+        try:
+            chunk = await asyncio.to_thread(next, chunks, None)
+        except ImportFileError as e:
+            if first_row == 1:
+                raise
+            # Earlier chunks are committed: report them along with the error
+            error = str(e)
+            break
+        if chunk is None:
+            break
+        records, rows, chunk_rejected = await asyncio.to_thread(validate_chunk, chunk, first_row)
+        first_row += len(chunk)
+
+        if records:
+            if is_postgres:
+                # Partitioned tables enforce invoice_no through a trigger; ask it to skip duplicates
+                await db.execute(text("SELECT set_config('invoices.skip_duplicates', 'on', true)"))
+            # Numbers held by the SQLite archive table are duplicates too
+            archived = await archived_invoice_numbers(db, [record["invoice_no"] for record in records])
+            new_records = [record for record in records if record["invoice_no"] not in archived]
+            inserted_ids = {}
+            if new_records:
+                result = await db.execute(stmt, new_records)
+                inserted_ids = {invoice_no: invoice_id for invoice_id, invoice_no in result.all()}
+            await db.commit()
+            inserted += len(inserted_ids)
+            changes = []
+            snapshot_rows = []
+            # Rows missing from RETURNING hit an existing (or repeated) invoice_no
+            for row, record in zip(rows, records):
+                if record["invoice_no"] in inserted_ids:
+                    invoice_id = inserted_ids.pop(record["invoice_no"])
+                    changes.append((record["invoice_date"], record["amount"]))
+                    snapshot_rows.append((invoice_id, *(record[column] for column in SNAPSHOT_COLUMNS[1:])))
+                else:
+                    chunk_rejected.append(
+                        {"row": row, "invoice_no": record["invoice_no"], "errors": ["invoice_no already exists"]}
+                    )
+            if changes:
+                generation = await publish("invoices.imported", {
+                    "inserted": len(changes),
+                    "ids": [row[0] for row in snapshot_rows],
+                    "revenue": revenue_delta(changes),
+                })
+                record_rows(generation, snapshot_rows)
+
+        rejected_count += len(chunk_rejected)
+        chunk_rejected.sort(key=lambda r: r["row"])
+        rejected.extend(chunk_rejected[:MAX_REPORTED_REJECTIONS - len(rejected)])
+
+    return {
+        "inserted": inserted,
+        "rejected_count": rejected_count,
+        "rejected": rejected,
+        "rejected_truncated": rejected_count > len(rejected),
+        "error": error,
+        "aborted_at_row": first_row if error else None,
+    }
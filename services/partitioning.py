@@ -0,0 +1,474 @@
+import argparse
+import asyncio
+import logging
+import re
+from datetime import date, timedelta
+from typing import Optional
+
+from sqlalchemy import MetaData, delete, func, select, union_all
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from database import engine
+from models.invoice import Invoice, InvoiceArchive
+from services.search import setup_archive_search_index, setup_search_index
+
+"""
+This module manages time-partitioned invoice storage.
+
+On Postgres, `setup` turns `invoices` into a table range-partitioned on
+invoice_date (monthly or per financial year), so date-filtered queries
+only scan the matching partitions. Partitions keep the global uniqueness
+of invoice_no through the `invoice_numbers` table, maintained by triggers.
+On SQLite, which has no partitioning, closed years move to an
+`invoices_archive` table that queries only read when their date range
+reaches into archived years. There, ids are AUTOINCREMENT so archived ids
+are never handed out again, and triggers keep invoice_no unique across
+both tables.
+
+`archive` moves closed financial years (April to March) to compact
+read-only storage: one frozen, write-protected partition per year on
+Postgres, or rows moved into `invoices_archive` on SQLite.
+
+    python -m services.partitioning setup --granularity month
+    python -m services.partitioning archive --keep-closed 1
+"""
+
+FY_START_MONTH = 4  # Indian financial year: April to March
+READ_ONLY_MESSAGE = "invoices of archived financial years are read-only"
+GRANULARITIES = ("month", "fy")
+
+logger = logging.getLogger(__name__)
+
+# Same columns as invoices; created only when SQLite archiving is used
+invoices_archive = Invoice.__table__.to_metadata(MetaData(), name="invoices_archive")
+INVOICE_COLUMNS = [column.name for column in Invoice.__table__.columns]
+
+
+def fy_start(day: date) -> date:
+    """First day of the financial year containing `day`."""
+    year = day.year if day.month >= FY_START_MONTH else day.year - 1
+    return date(year, FY_START_MONTH, 1)
+
+
+def add_months(day: date, months: int) -> date:
+    """The first of the month `months` months after `day`'s month."""
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_ranges(first: date, last: date, granularity: str):
+    """(name, start, end) of every partition needed to cover first..last."""
+    step = 1 if granularity == "month" else 12
+    start = fy_start(first) if granularity == "fy" else date(first.year, first.month, 1)
+    ranges = []
+    while start <= last:
+        end = add_months(start, step)
+        if granularity == "fy":
+            name = f"invoices_fy{start.year}"
+        else:
+            name = f"invoices_p{start.year}_{start.month:02d}"
+        ranges.append((name, start, end))
+        start = end
+    return ranges
+
+
+# ---------------------------------------------------------------------------
+# Read path
+# ---------------------------------------------------------------------------
+
+async def archived_until(session: AsyncSession) -> Optional[date]:
+    """
+    Last day held in the SQLite archive table, or None when nothing is
+    archived. Postgres keeps archived years in the partitioned table itself.
+    """
+    if session.bind.dialect.name != "sqlite":
+        return None
+    result = await session.execute(select(func.max(InvoiceArchive.fy_end)))
+    return result.scalar()
+
+
+async def invoice_source(session: AsyncSession, from_date: date = None, to_date: date = None):
+    """
+    Return the invoice columns to query for a date range, as Core columns
+    (`select(*source)` reads whole rows). Postgres prunes partitions from
+    the invoice_date filter on its own; on SQLite the archive table is only
+    read when the range reaches into archived years.
+    """
+    until = await archived_until(session)
+    if until is None or (from_date is not None and from_date > until):
+        return Invoice.__table__.c
+    # Core rows, not ORM entities: the identity map would merge rows sharing an id
+    return union_all(select(Invoice.__table__), select(invoices_archive)).subquery("invoices_all").c
+
+
+async def archived_years(session: AsyncSession):
+    """(fy_start, fy_end) of every archived, read-only financial year."""
+    result = await session.execute(select(InvoiceArchive.fy_start, InvoiceArchive.fy_end))
+    return result.all()
+
+
+async def get_archived_invoice(session: AsyncSession, invoice_id: int):
+    """The SQLite archive row of an invoice, or None if it is not archived there."""
+    if await archived_until(session) is None:
+        return None
+    result = await session.execute(select(invoices_archive).where(invoices_archive.c.id == invoice_id))
+    return result.mappings().first()
+
+
+async def archived_invoice_numbers(session: AsyncSession, invoice_numbers):
+    """The given invoice numbers already taken by invoices in the SQLite archive."""
+    if not invoice_numbers or await archived_until(session) is None:
+        return set()
+    result = await session.execute(
+        select(invoices_archive.c.invoice_no).where(invoices_archive.c.invoice_no.in_(invoice_numbers))
+    )
+    return set(result.scalars().all())
+
+
+def is_archived_write(error: DBAPIError) -> bool:
+    """Whether a database error comes from writing to an archived financial year."""
+    return READ_ONLY_MESSAGE in str(error.orig)
+
+
+# ---------------------------------------------------------------------------
+# Postgres partitioning
+# ---------------------------------------------------------------------------
+
+PG_NUMBER_FUNCTIONS = [
+    """CREATE TABLE IF NOT EXISTS invoice_numbers (
+        invoice_no VARCHAR PRIMARY KEY,
+        invoice_id INTEGER NOT NULL
+    )""",
+    # Claims NEW.invoice_no for the row. A row moving between partitions
+    # re-claims its own number; any other holder is a duplicate.
+    """CREATE OR REPLACE FUNCTION invoices_claim_number() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'UPDATE' THEN
+            IF NEW.invoice_no = OLD.invoice_no THEN
+                RETURN NEW;
+            END IF;
+            DELETE FROM invoice_numbers WHERE invoice_no = OLD.invoice_no AND invoice_id = OLD.id;
+        END IF;
+        INSERT INTO invoice_numbers (invoice_no, invoice_id) VALUES (NEW.invoice_no, NEW.id)
+        ON CONFLICT (invoice_no) DO UPDATE SET invoice_id = EXCLUDED.invoice_id
+        WHERE invoice_numbers.invoice_id = EXCLUDED.invoice_id;
+        IF NOT FOUND THEN
+            -- Bulk imports skip duplicates the way ON CONFLICT DO NOTHING would
+            IF TG_OP = 'INSERT' AND current_setting('invoices.skip_duplicates', true) = 'on' THEN
+                RETURN NULL;
+            END IF;
+            RAISE unique_violation USING MESSAGE = format('duplicate invoice_no "%s"', NEW.invoice_no);
+        END IF;
+        RETURN NEW;
+    END $$""",
+    """CREATE OR REPLACE FUNCTION invoices_release_number() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        DELETE FROM invoice_numbers WHERE invoice_no = OLD.invoice_no AND invoice_id = OLD.id;
+        RETURN OLD;
+    END $$""",
+    """CREATE OR REPLACE FUNCTION invoices_reject_archived_write() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        RAISE EXCEPTION 'invoices of archived financial years are read-only';
+    END $$""",
+]
+
+PG_NUMBER_TRIGGERS = [
+    """CREATE TRIGGER invoices_claim_number BEFORE INSERT OR UPDATE OF invoice_no ON invoices
+        FOR EACH ROW EXECUTE FUNCTION invoices_claim_number()""",
+    """CREATE TRIGGER invoices_release_number BEFORE DELETE ON invoices
+        FOR EACH ROW EXECUTE FUNCTION invoices_release_number()""",
+]
+
+BOUND_PATTERN = re.compile(r"FROM \('(\d{4}-\d{2}-\d{2})'\) TO \('(\d{4}-\d{2}-\d{2})'\)")
+
+
+async def _scalar(conn: AsyncConnection, sql: str):
+    return (await conn.exec_driver_sql(sql)).scalar()
+
+
+async def pg_granularity(conn: AsyncConnection) -> Optional[str]:
+    """The partition granularity of `invoices`, or None if it is not partitioned."""
+    comment = await _scalar(
+        conn,
+        "SELECT obj_description(p.partrelid, 'pg_class') FROM pg_partitioned_table p "
+        "WHERE p.partrelid = 'invoices'::regclass"
+    )
+    if comment is None:
+        return None
+    return comment.split(":", 1)[-1]
+
+
+async def pg_partitions(conn: AsyncConnection):
+    """(name, start, end) of every bounded partition of `invoices`."""
+    result = await conn.exec_driver_sql(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = 'invoices'::regclass"
+    )
+    partitions = []
+    for name, bound in result.all():
+        match = BOUND_PATTERN.search(bound)
+        if match:
+            partitions.append((name, date.fromisoformat(match[1]), date.fromisoformat(match[2])))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+async def _create_partitions(conn: AsyncConnection, ranges):
+    for name, start, end in ranges:
+        await conn.exec_driver_sql(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF invoices "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+
+
+async def ensure_partitions(conn: AsyncConnection, granularity: str):
+    """Create the partitions of the current and next financial year."""
+    current = fy_start(date.today())
+    ranges = partition_ranges(current, add_months(current, 23), granularity)
+    existing = await pg_partitions(conn)
+    # Skip ranges already covered, e.g. by a merged archive partition
+    missing = [
+        (name, start, end) for name, start, end in ranges
+        if not any(p_start <= start and end <= p_end for _, p_start, p_end in existing)
+    ]
+    await _create_partitions(conn, missing)
+
+
+async def partition_postgres(conn: AsyncConnection, granularity: str):
+    """Convert a plain `invoices` table into a range-partitioned one."""
+    first = await _scalar(conn, "SELECT min(invoice_date) FROM invoices") or date.today()
+    sequence = await _scalar(conn, "SELECT pg_get_serial_sequence('invoices', 'id')")
+    last = add_months(fy_start(date.today()), 23)
+
+    await conn.exec_driver_sql("ALTER TABLE invoices RENAME TO invoices_unpartitioned")
+    await conn.exec_driver_sql(
+        "CREATE TABLE invoices (LIKE invoices_unpartitioned INCLUDING DEFAULTS) "
+        "PARTITION BY RANGE (invoice_date)"
+    )
+    await _create_partitions(conn, partition_ranges(first, last, granularity))
+    await conn.exec_driver_sql("CREATE TABLE invoices_default PARTITION OF invoices DEFAULT")
+    await conn.exec_driver_sql("INSERT INTO invoices SELECT * FROM invoices_unpartitioned")
+    if sequence:
+        await conn.exec_driver_sql(f"ALTER SEQUENCE {sequence} OWNED BY invoices.id")
+    await conn.exec_driver_sql("DROP TABLE invoices_unpartitioned")
+
+    # Indexes are built after the bulk copy; the partition key must be in the primary key
+    await conn.exec_driver_sql("ALTER TABLE invoices ADD PRIMARY KEY (id, invoice_date)")
+    await conn.exec_driver_sql("CREATE INDEX ix_invoices_id ON invoices (id)")
+    await conn.exec_driver_sql("CREATE INDEX ix_invoices_invoice_no ON invoices (invoice_no)")
+    await conn.exec_driver_sql("CREATE INDEX ix_invoices_invoice_date ON invoices (invoice_date)")
+    for statement in PG_NUMBER_FUNCTIONS:
+        await conn.exec_driver_sql(statement)
+    await conn.exec_driver_sql("INSERT INTO invoice_numbers SELECT invoice_no, id FROM invoices")
+    for statement in PG_NUMBER_TRIGGERS:
+        await conn.exec_driver_sql(statement)
+    await conn.exec_driver_sql(f"COMMENT ON TABLE invoices IS 'partitioned:{granularity}'")
+    await setup_search_index(conn)
+
+
+async def archive_postgres(conn: AsyncConnection, start: date, end: date):
+    """
+    Merge the partitions of one financial year into a single partition and
+    make it read-only. Returns the partition name and its row count.
+    """
+    name = f"invoices_fy{start.year}"
+    parts = [p for p in await pg_partitions(conn) if start <= p[1] and p[2] <= end]
+    if [p[0] for p in parts] != [name]:
+        merged = f"{name}_merged"
+        await conn.exec_driver_sql(f"CREATE TABLE {merged} (LIKE invoices INCLUDING DEFAULTS)")
+        for part, _, _ in parts:
+            await conn.exec_driver_sql(f"ALTER TABLE invoices DETACH PARTITION {part}")
+            await conn.exec_driver_sql(f"INSERT INTO {merged} SELECT * FROM {part} ORDER BY invoice_date, id")
+            await conn.exec_driver_sql(f"DROP TABLE {part}")
+        # Rows of the year outside every bounded partition (e.g. backdated
+        # before the first one) sit in the default partition and would make
+        # ATTACH fail. Deleting them releases their numbers; claim them again.
+        await conn.exec_driver_sql(
+            f"WITH moved AS (DELETE FROM invoices_default "
+            f"WHERE invoice_date >= '{start.isoformat()}' AND invoice_date < '{end.isoformat()}' RETURNING *) "
+            f"INSERT INTO {merged} SELECT * FROM moved ORDER BY invoice_date, id"
+        )
+        await conn.exec_driver_sql(
+            f"INSERT INTO invoice_numbers (invoice_no, invoice_id) SELECT invoice_no, id FROM {merged} "
+            "ON CONFLICT (invoice_no) DO NOTHING"
+        )
+        await conn.exec_driver_sql(f"ALTER TABLE {merged} RENAME TO {name}")
+        await conn.exec_driver_sql(
+            f"ALTER TABLE invoices ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+    await conn.exec_driver_sql(
+        f"CREATE TRIGGER invoices_archived_readonly BEFORE INSERT OR UPDATE OR DELETE ON {name} "
+        "FOR EACH ROW EXECUTE FUNCTION invoices_reject_archived_write()"
+    )
+    return name, await _scalar(conn, f"SELECT count(*) FROM {name}")
+
+
+# ---------------------------------------------------------------------------
+# SQLite archive table
+# ---------------------------------------------------------------------------
+
+SQLITE_ARCHIVE_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS invoices_archive_no_update BEFORE UPDATE ON invoices_archive
+    BEGIN SELECT RAISE(ABORT, '{READ_ONLY_MESSAGE}'); END""",
+    f"""CREATE TRIGGER IF NOT EXISTS invoices_archive_no_delete BEFORE DELETE ON invoices_archive
+    BEGIN SELECT RAISE(ABORT, '{READ_ONLY_MESSAGE}'); END""",
+    # invoice_no stays unique across both tables; RAISE in a trigger is an IntegrityError
+    """CREATE TRIGGER IF NOT EXISTS invoices_archived_number_insert BEFORE INSERT ON invoices
+    WHEN EXISTS (SELECT 1 FROM invoices_archive WHERE invoice_no = NEW.invoice_no)
+    BEGIN SELECT RAISE(ABORT, 'UNIQUE constraint failed: invoices.invoice_no (archived)'); END""",
+    """CREATE TRIGGER IF NOT EXISTS invoices_archived_number_update BEFORE UPDATE OF invoice_no ON invoices
+    WHEN NEW.invoice_no != OLD.invoice_no
+        AND EXISTS (SELECT 1 FROM invoices_archive WHERE invoice_no = NEW.invoice_no)
+    BEGIN SELECT RAISE(ABORT, 'UNIQUE constraint failed: invoices.invoice_no (archived)'); END""",
+]
+
+
+async def ensure_sqlite_ids(conn: AsyncConnection):
+    """
+    Make sure new invoices never reuse the id of an archived one. Tables
+    created before `invoices` used AUTOINCREMENT are rebuilt with it (SQLite
+    otherwise hands out max(id) + 1), and the id sequence is moved past the
+    highest archived id.
+    """
+    table_sql = await _scalar(conn, "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'invoices'")
+    if "AUTOINCREMENT" not in table_sql.upper():
+        columns = ", ".join(INVOICE_COLUMNS)
+        # Renaming takes the indexes and triggers along; they are recreated below
+        await conn.exec_driver_sql("ALTER TABLE invoices RENAME TO invoices_rowid")
+        result = await conn.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'invoices_rowid' AND sql IS NOT NULL"
+        )
+        for (index,) in result.all():
+            await conn.exec_driver_sql(f"DROP INDEX {index}")
+        await conn.run_sync(lambda sync_conn: Invoice.__table__.create(sync_conn))
+        await conn.exec_driver_sql(f"INSERT INTO invoices ({columns}) SELECT {columns} FROM invoices_rowid")
+        await conn.exec_driver_sql("DROP TABLE invoices_rowid")
+        # The search triggers went with the old table; rebuild the index from scratch
+        await conn.exec_driver_sql("DROP TABLE IF EXISTS invoices_fts")
+        await setup_search_index(conn)
+    top = await _scalar(conn, "SELECT max(id) FROM (SELECT id FROM invoices UNION ALL SELECT id FROM invoices_archive)")
+    if top is not None:
+        updated = await conn.exec_driver_sql(
+            f"UPDATE sqlite_sequence SET seq = max(seq, {int(top)}) WHERE name = 'invoices'"
+        )
+        if not updated.rowcount:
+            await conn.exec_driver_sql(f"INSERT INTO sqlite_sequence (name, seq) VALUES ('invoices', {int(top)})")
+
+
+async def setup_sqlite_archive(conn: AsyncConnection):
+    """
+    Create the archive table, its read-only triggers, its search index and
+    non-reusable invoice ids.
+    """
+    await conn.run_sync(lambda sync_conn: invoices_archive.create(sync_conn, checkfirst=True))
+    await ensure_sqlite_ids(conn)
+    for statement in SQLITE_ARCHIVE_TRIGGERS:
+        await conn.exec_driver_sql(statement)
+    await setup_archive_search_index(conn)
+
+
+async def archive_sqlite(conn: AsyncConnection, start: date, end: date):
+    """Move one financial year from `invoices` into `invoices_archive`."""
+    in_year = (Invoice.invoice_date >= start) & (Invoice.invoice_date < end)
+    columns = [Invoice.__table__.c[name] for name in INVOICE_COLUMNS]
+    result = await conn.execute(
+        invoices_archive.insert().from_select(
+            INVOICE_COLUMNS,
+            select(*columns).where(in_year).order_by(Invoice.invoice_date, Invoice.id)
+        )
+    )
+    await conn.execute(delete(Invoice.__table__).where(in_year))
+    return "invoices_archive", result.rowcount
+
+
+# ---------------------------------------------------------------------------
+# Entry points
+# ---------------------------------------------------------------------------
+
+async def setup_storage(conn: AsyncConnection):
+    """
+    Startup hook: index invoice_date, keep upcoming partitions created and
+    bring an existing SQLite archive up to date (ids, invoice_no triggers).
+    """
+    await conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_invoices_invoice_date ON invoices (invoice_date)")
+    if conn.dialect.name == "postgresql":
+        granularity = await pg_granularity(conn)
+        if granularity:
+            await ensure_partitions(conn, granularity)
+    elif await _scalar(conn, "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'invoices_archive'"):
+        await setup_sqlite_archive(conn)
+
+
+async def setup(granularity: str):
+    """Switch the database to the partitioned (or archive-table) layout."""
+    async with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            if await pg_granularity(conn):
+                logger.info("invoices is already partitioned")
+                await ensure_partitions(conn, await pg_granularity(conn))
+            else:
+                await partition_postgres(conn, granularity)
+        else:
+            await setup_sqlite_archive(conn)
+
+
+async def archive(keep_closed: int = 0):
+    """Archive every closed financial year except the `keep_closed` latest ones."""
+    cutoff = add_months(fy_start(date.today()), -12 * keep_closed)
+    archived = []
+    async with engine.begin() as conn:
+        if conn.dialect.name != "postgresql":
+            await setup_sqlite_archive(conn)
+        elif not await pg_granularity(conn):
+            raise SystemExit("Run `setup` first: invoices is not partitioned")
+
+        first = (await conn.execute(select(func.min(Invoice.invoice_date)))).scalar()
+        done = set((await conn.execute(select(InvoiceArchive.fy_start))).scalars().all())
+        start = fy_start(first) if first else cutoff
+        while start < cutoff:
+            end = add_months(start, 12)
+            if start not in done:
+                if conn.dialect.name == "postgresql":
+                    table, rows = await archive_postgres(conn, start, end)
+                else:
+                    table, rows = await archive_sqlite(conn, start, end)
+                await conn.execute(
+                    InvoiceArchive.__table__.insert().values(
+                        fy_start=start, fy_end=end - timedelta(days=1), row_count=rows
+                    )
+                )
+                archived.append((table, start, rows))
+            start = end
+
+    # Reclaim space and freeze the archived rows; VACUUM cannot run in a transaction
+    if archived:
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            if conn.dialect.name == "postgresql":
+                for table in sorted({table for table, _, _ in archived}):
+                    await conn.exec_driver_sql(f"VACUUM (FULL, FREEZE, ANALYZE) {table}")
+            else:
+                await conn.exec_driver_sql("VACUUM")
+    return archived
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage partitioned and archived invoice storage.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    setup_parser = commands.add_parser("setup", help="Partition invoices (Postgres) or create the archive table (SQLite)")
+    setup_parser.add_argument("--granularity", choices=GRANULARITIES, default="month")
+    archive_parser = commands.add_parser("archive", help="Move closed financial years to read-only storage")
+    archive_parser.add_argument("--keep-closed", type=int, default=0, help="Closed years to keep in hot storage")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "setup":
+        asyncio.run(setup(args.granularity))
+    else:
+        for table, start, rows in asyncio.run(archive(args.keep_closed)):
+            print(f"Archived FY{start.year}-{(start.year + 1) % 100:02d}: {rows} invoices -> {table}")
+
+
+if __name__ == "__main__":
+    main()
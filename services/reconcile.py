@@ -0,0 +1,190 @@
+import xml.etree.ElementTree as ET
+from datetime import date
+
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from models.invoice import Invoice, InvoiceStatus
+from services.partitioning import archived_years, invoice_source
+
+"""
+This module reconciles local invoices against Tally sales vouchers.
+Both sides are loaded into DataFrames (the local side through an indexed
+invoice_date range query, the Tally side parsed from the voucher
+collection) and matched with pandas hash joins: invoice_no against the
+voucher REFERENCE first, then against VOUCHERNUMBER for vouchers whose
+reference is empty or different. Matched pairs are then compared on amount.
+"""
+
+AMOUNT_TOLERANCE = 1.0  # rupees, absorbs voucher rounding
+STATUS_UPDATE_BATCH = 5000  # keeps the IN list under the drivers' parameter limits
+
+VOUCHER_FIELDS = ["VOUCHERNUMBER", "REFERENCE", "DATE", "VOUCHERTYPENAME", "PARTYLEDGERNAME", "AMOUNT"]
+
+
+def build_voucher_request(from_date: date, to_date: date) -> str:
+    """Tally export request for every voucher between the two dates."""
+    return f"""
+    <ENVELOPE>
+        <HEADER>
+            <VERSION>1</VERSION>
+            <TALLYREQUEST>Export</TALLYREQUEST>
+            <TYPE>Collection</TYPE>
+            <ID>Reconcile Voucher Collection</ID>
+        </HEADER>
+        <BODY>
+            <DESC>
+                <STATICVARIABLES>
+                    <SVEXPORTFORMAT>$$SysName:XML</SVEXPORTFORMAT>
+                    <SVFROMDATE>{from_date.strftime("%Y%m%d")}</SVFROMDATE>
+                    <SVTODATE>{to_date.strftime("%Y%m%d")}</SVTODATE>
+                </STATICVARIABLES>
+                <TDL>
+                    <TDLMESSAGE>
+                        <COLLECTION NAME="Reconcile Voucher Collection" ISMODIFY="No">
+                            <TYPE>Voucher</TYPE>
+                            <FETCH>{", ".join(VOUCHER_FIELDS)}</FETCH>
+                        </COLLECTION>
+                    </TDLMESSAGE>
+                </TDL>
+            </DESC>
+        </BODY>
+    </ENVELOPE>
+    """
+
+
+def _normalize_keys(values):
+    return values.fillna("").astype(str).str.strip().str.upper()
+
+
+def parse_vouchers(xml_text: str, voucher_type: str = None):
+    """Parse the voucher collection into a DataFrame, one row per voucher."""
+    import pandas as pd
+
+    root = ET.fromstring(xml_text)
+    columns = {field: [] for field in VOUCHER_FIELDS}
+    for voucher in root.iter("VOUCHER"):
+        for field in VOUCHER_FIELDS:
+            columns[field].append(voucher.findtext(field, ""))
+
+    vouchers = pd.DataFrame({
+        "voucher_number": columns["VOUCHERNUMBER"],
+        "reference": columns["REFERENCE"],
+        "voucher_date": pd.to_datetime(pd.Series(columns["DATE"], dtype=str), format="%Y%m%d", errors="coerce"),
+        "voucher_type": columns["VOUCHERTYPENAME"],
+        "party": columns["PARTYLEDGERNAME"],
+        # Sales vouchers carry the party debit as a negative amount
+        "tally_amount": pd.to_numeric(pd.Series(columns["AMOUNT"], dtype=str), errors="coerce").abs(),
+    })
+    if voucher_type:
+        vouchers = vouchers[vouchers["voucher_type"].str.casefold() == voucher_type.casefold()]
+    return vouchers.reset_index(drop=True)
+
+
+async def load_local_invoices(session: AsyncSession, from_date: date, to_date: date):
+    """Load the invoices of the date range as a DataFrame."""
+    import pandas as pd
+
+    source = await invoice_source(session, from_date, to_date)
+    result = await session.execute(
+        select(source.id, source.invoice_no, source.invoice_date, source.amount, source.status)
+        .where(source.invoice_date >= from_date, source.invoice_date <= to_date)
+        .order_by(source.invoice_date, source.id)
+    )
+    rows = result.all()
+    return pd.DataFrame({
+        "invoice_id": [row.id for row in rows],
+        "invoice_no": [row.invoice_no for row in rows],
+        "invoice_date": pd.to_datetime([row.invoice_date for row in rows]),
+        "amount": pd.Series([row.amount for row in rows], dtype=float),
+        "status": [row.status.value for row in rows],
+    })
+
+
+def _records(frame, columns):
+    frame = frame[columns].copy()
+    for column in ("invoice_date", "voucher_date"):
+        if column in frame:
+            frame[column] = frame[column].dt.strftime("%Y-%m-%d")
+    frame = frame.astype(object).where(frame.notna(), None)
+    return frame.to_dict(orient="records")
+
+
+def reconcile_frames(local, voucher_frames):
+    """
+    Match local invoices to Tally vouchers (one frame per Tally target,
+    labelled with a `target` column) and classify every row as matched,
+    amount mismatch, missing in Tally or missing locally.
+    """
+    import numpy as np
+    import pandas as pd
+
+    vouchers = pd.concat(voucher_frames, ignore_index=True)
+    local = local.assign(key=_normalize_keys(local["invoice_no"]))
+    vouchers = vouchers.assign(
+        voucher_index=np.arange(len(vouchers)),
+        reference_key=_normalize_keys(vouchers["reference"]),
+        number_key=_normalize_keys(vouchers["voucher_number"]),
+    )
+
+    # One lookup table of (key, voucher): references first, then voucher
+    # numbers, so an invoice_no matching a reference wins over a number
+    keys = pd.concat([
+        vouchers[["reference_key", "voucher_index"]].rename(columns={"reference_key": "key"}),
+        vouchers[["number_key", "voucher_index"]].rename(columns={"number_key": "key"}),
+    ])
+    keys = keys[keys["key"] != ""].drop_duplicates("key")
+
+    pairs = local.merge(keys, on="key", how="inner")
+    # A voucher matched through both its reference and its number pairs once
+    pairs = pairs.drop_duplicates("voucher_index").merge(vouchers, on="voucher_index")
+    pairs = pairs.sort_values(["invoice_date", "invoice_id"], kind="stable")
+    pairs["difference"] = (pairs["amount"] - pairs["tally_amount"]).round(2)
+    amounts_agree = np.isclose(pairs["amount"], pairs["tally_amount"], rtol=0, atol=AMOUNT_TOLERANCE)
+
+    matched = pairs[amounts_agree]
+    mismatched = pairs[~amounts_agree]
+    missing_in_tally = local[~local["invoice_id"].isin(pairs["invoice_id"])]
+    missing_locally = vouchers[~vouchers["voucher_index"].isin(pairs["voucher_index"])]
+
+    pair_columns = ["invoice_id", "invoice_no", "invoice_date", "amount", "status",
+                    "target", "voucher_number", "reference", "voucher_date", "tally_amount", "difference"]
+    return {
+        "summary": {
+            "local_invoices": len(local),
+            "tally_vouchers": len(vouchers),
+            "matched": len(matched),
+            "amount_mismatch": len(mismatched),
+            "missing_in_tally": len(missing_in_tally),
+            "missing_locally": len(missing_locally),
+        },
+        "matched": _records(matched, ["invoice_id", "invoice_no", "target", "voucher_number", "amount"]),
+        "amount_mismatch": _records(mismatched, pair_columns),
+        "missing_in_tally": _records(missing_in_tally, ["invoice_id", "invoice_no", "invoice_date", "amount", "status"]),
+        "missing_locally": _records(
+            missing_locally,
+            ["target", "voucher_number", "reference", "voucher_date", "voucher_type", "party", "tally_amount"]
+        ),
+    }
+
+
+async def update_matched_status(session: AsyncSession, invoice_ids, status: InvoiceStatus):
+    """
+    Set `status` on the given invoices in batched UPDATE statements; one
+    commit. Invoices of archived financial years are read-only and left out.
+    """
+    conditions = [Invoice.status != status]
+    conditions += [~Invoice.invoice_date.between(fy_start, fy_end) for fy_start, fy_end in await archived_years(session)]
+    updated = []
+    for start in range(0, len(invoice_ids), STATUS_UPDATE_BATCH):
+        result = await session.execute(
+            update(Invoice)
+            .where(Invoice.id.in_(invoice_ids[start:start + STATUS_UPDATE_BATCH]), *conditions)
+            .values(status=status)
+            .returning(Invoice.id)
+            .execution_options(synchronize_session=False)
+        )
+        updated.extend(result.scalars().all())
+    await session.commit()
+    return updated
@@ -0,0 +1,149 @@
+import re
+
+from sqlalchemy import column, literal_column, table, text, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from models.invoice import Invoice
+
+"""
+This module provides indexed full-text search over invoices.
+On SQLite an FTS5 external-content table mirrors invoice_no, company_name,
+buyer_details and description, kept in sync by triggers on every write.
+Invoices moved to the SQLite archive table are indexed in a second FTS5
+table, and searches read both.
+On Postgres a GIN tsvector index (ranked, prefix matching) and a pg_trgm
+index (fuzzy matching of the query against the words of the document) are
+built on the same fields; expression indexes are maintained by the
+database itself.
+"""
+
+SEARCH_COLUMNS = ["invoice_no", "company_name", "buyer_details", "description"]
+
+# bm25 weights, in SEARCH_COLUMNS order
+SQLITE_COLUMN_WEIGHTS = "10.0, 5.0, 3.0, 1.0"
+
+# Must match the indexed expressions exactly for Postgres to use the indexes.
+# Dashes and slashes become spaces so "INV-12" indexes as "inv" and "12"
+# rather than "inv" and the signed number "-12".
+PG_DOCUMENT = "translate(invoice_no || ' ' || company_name || ' ' || buyer_details || ' ' || description, '-/', '  ')"
+PG_TSVECTOR = f"to_tsvector('simple', {PG_DOCUMENT})"
+
+_columns = ", ".join(SEARCH_COLUMNS)
+_new_values = ", ".join(f"new.{name}" for name in SEARCH_COLUMNS)
+_old_values = ", ".join(f"old.{name}" for name in SEARCH_COLUMNS)
+
+SQLITE_SETUP = [
+    f"""CREATE VIRTUAL TABLE invoices_fts USING fts5(
+        {_columns}, content='invoices', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS invoices_fts_insert AFTER INSERT ON invoices BEGIN
+        INSERT INTO invoices_fts(rowid, {_columns}) VALUES (new.id, {_new_values});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS invoices_fts_delete AFTER DELETE ON invoices BEGIN
+        INSERT INTO invoices_fts(invoices_fts, rowid, {_columns}) VALUES ('delete', old.id, {_old_values});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS invoices_fts_update AFTER UPDATE OF {_columns} ON invoices BEGIN
+        INSERT INTO invoices_fts(invoices_fts, rowid, {_columns}) VALUES ('delete', old.id, {_old_values});
+        INSERT INTO invoices_fts(rowid, {_columns}) VALUES (new.id, {_new_values});
+    END""",
+    # Index the rows that existed before the FTS table was created
+    "INSERT INTO invoices_fts(invoices_fts) VALUES ('rebuild')",
+]
+
+SQLITE_ARCHIVE_SETUP = [
+    f"""CREATE VIRTUAL TABLE invoices_archive_fts USING fts5(
+        {_columns}, content='invoices_archive', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    # Archived rows are read-only: they are only ever inserted
+    f"""CREATE TRIGGER IF NOT EXISTS invoices_archive_fts_insert AFTER INSERT ON invoices_archive BEGIN
+        INSERT INTO invoices_archive_fts(rowid, {_columns}) VALUES (new.id, {_new_values});
+    END""",
+    "INSERT INTO invoices_archive_fts(invoices_archive_fts) VALUES ('rebuild')",
+]
+
+POSTGRES_SETUP = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"CREATE INDEX IF NOT EXISTS ix_invoices_search_tsv ON invoices USING GIN ({PG_TSVECTOR})",
+    f"CREATE INDEX IF NOT EXISTS ix_invoices_search_trgm ON invoices USING GIN ({PG_DOCUMENT} gin_trgm_ops)",
+]
+
+invoices_fts = table("invoices_fts", column("rowid"))
+invoices_archive_fts = table("invoices_archive_fts", column("rowid"))
+
+
+async def setup_search_index(conn):
+    """Create the search index for the connected database if it is missing."""
+    if conn.dialect.name == "postgresql":
+        for statement in POSTGRES_SETUP:
+            await conn.exec_driver_sql(statement)
+    elif conn.dialect.name == "sqlite":
+        result = await conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'invoices_fts'"
+        )
+        if result.first() is None:
+            for statement in SQLITE_SETUP:
+                await conn.exec_driver_sql(statement)
+
+
+async def setup_archive_search_index(conn):
+    """Create the search index of the SQLite archive table if it is missing."""
+    result = await conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'invoices_archive_fts'"
+    )
+    if result.first() is None:
+        for statement in SQLITE_ARCHIVE_SETUP:
+            await conn.exec_driver_sql(statement)
+
+
+def _sqlite_matches(source, fts, match: str):
+    """Rows of `source` matching `match` in its FTS table, with their bm25 rank."""
+    rank = literal_column(f"bm25({fts.name}, {SQLITE_COLUMN_WEIGHTS})").label("rank")
+    return (
+        select(*source.c, rank)
+        .join(fts, fts.c.rowid == source.c.id)
+        .where(literal_column(fts.name).op("MATCH")(match))
+    )
+
+
+def search_terms(q: str):
+    """Split a query into word tokens, dropping FTS operators and punctuation."""
+    return re.findall(r"\w+", q)
+
+
+async def search_invoices(session: AsyncSession, q: str, limit: int, offset: int):
+    """
+    Return invoices matching every term of `q` (each term as a prefix),
+    best matches first, as row mappings.
+    """
+    terms = search_terms(q)
+    if not terms:
+        return []
+
+    if session.bind.dialect.name == "postgresql":
+        params = {"tsquery": " & ".join(f"{term}:*" for term in terms), "q": q}
+        matches = text(
+            f"{PG_TSVECTOR} @@ to_tsquery('simple', :tsquery) OR :q <% {PG_DOCUMENT}"
+        ).bindparams(**params)
+        # Whole-document similarity is diluted by the other fields; compare
+        # the query with the closest run of words instead
+        rank = text(
+            f"ts_rank({PG_TSVECTOR}, to_tsquery('simple', :tsquery)) + word_similarity(:q, {PG_DOCUMENT}) DESC"
+        ).bindparams(**params)
+        query = select(*Invoice.__table__.c).where(matches).order_by(rank, Invoice.id)
+    else:
+        from services.partitioning import archived_until, invoices_archive
+        match = " ".join(f'"{term}"*' for term in terms)
+        matches = _sqlite_matches(Invoice.__table__, invoices_fts, match)
+        if await archived_until(session) is not None:
+            matches = union_all(matches, _sqlite_matches(invoices_archive, invoices_archive_fts, match))
+        found = matches.subquery("found")
+        query = (
+            select(*(found.c[name] for name in Invoice.__table__.c.keys()))
+            .order_by(found.c.rank, found.c.id)
+        )
+
+    result = await session.execute(query.limit(limit).offset(offset))
+    return result.mappings().all()
@@ -0,0 +1,228 @@
+import asyncio
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+"""
+This module is a cache shared by all server worker processes, stored in a
+local SQLite file (WAL mode, so readers never block each other). Analytics
+and forecast results computed by one worker are reused by the others.
+
+Invoice writes bump a data generation counter in the same file. Cache keys
+include the generation, so every worker stops reading results computed
+before the latest write; stale entries are never read again and age out.
+Entries also expire after their TTL, and the least recently used ones are
+evicted once the cache exceeds SHARED_CACHE_MAX_MB. Reads never write:
+cache hits are remembered in memory and their last-use times written with
+the worker's next `put`, which is also when eviction runs.
+
+Every function here blocks on SQLite (writers wait up to 10s for the
+lock), so async code calls them through `asyncio.to_thread`.
+
+The file also holds leases, so only one worker runs a job (such as the
+nightly model refit) at a time, and a short log of change feed events so
+every worker can relay the events published by the others. Each event
+records the generation it produced, so a worker can replay the changes
+made since the generation it last saw.
+"""
+
+CACHE_PATH = Path(os.getenv("SHARED_CACHE_PATH", Path(os.getenv("MODEL_DIR", "model_store")) / "shared_cache.sqlite3"))
+CACHE_MAX_BYTES = int(os.getenv("SHARED_CACHE_MAX_MB", "256")) * 1024 * 1024
+DEFAULT_TTL = int(os.getenv("SHARED_CACHE_TTL", "3600"))  # seconds
+EVENT_RETENTION = 300  # seconds an event stays readable by other workers
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_entries_last_used ON entries (last_used);
+CREATE TABLE IF NOT EXISTS generations (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    origin INTEGER NOT NULL,
+    generation INTEGER NOT NULL,
+    event_type TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+_local = threading.local()  # sqlite3 connections must stay in their thread
+_hits = {}  # key -> last cache hit not yet written to the file
+_hits_lock = threading.Lock()
+
+
+def _connection() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.pid != os.getpid():
+        CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(CACHE_PATH, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # a cache can lose the last writes on power loss
+        conn.executescript(SCHEMA)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(events)")]
+        if "generation" not in columns:
+            # Event log of an older file; its events are short-lived anyway
+            conn.executescript("DROP TABLE events;" + SCHEMA)
+        _local.conn, _local.pid = conn, os.getpid()
+    return conn
+
+
+def _holder() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def generation(name: str = "invoices") -> int:
+    """Current value of a data generation counter."""
+    row = _connection().execute("SELECT value FROM generations WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def bump_generation(name: str = "invoices") -> int:
+    """Mark the data as changed in every worker; returns the new generation."""
+    # fetchall() steps the statement to the end, so the write commits right away
+    rows = _connection().execute(
+        "INSERT INTO generations (name, value) VALUES (?, 1) "
+        "ON CONFLICT (name) DO UPDATE SET value = value + 1 RETURNING value",
+        (name,)
+    ).fetchall()
+    return rows[0][0]
+
+
+def get(key: str):
+    """Return the cached value for `key`, or None on a miss."""
+    now = time.time()
+    row = _connection().execute("SELECT value FROM entries WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+    if row is None:
+        return None
+    with _hits_lock:
+        _hits[key] = now
+    return pickle.loads(row[0])
+
+
+def put(key: str, value, ttl: int = DEFAULT_TTL):
+    """Store `value` under `key`, then evict expired and least recently used entries."""
+    conn = _connection()
+    now = time.time()
+    blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    with _hits_lock:
+        hits = list(_hits.items())
+        _hits.clear()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Apply this worker's cache hits before choosing what to evict
+        conn.executemany(
+            "UPDATE entries SET last_used = max(last_used, ?) WHERE key = ?",
+            [(used, hit_key) for hit_key, used in hits]
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (key, value, size, expires_at, last_used) VALUES (?, ?, ?, ?, ?)",
+            (key, blob, len(blob), now + ttl, now)
+        )
+        conn.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+        excess = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0] - CACHE_MAX_BYTES
+        if excess > 0:
+            evict = []
+            for old_key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_used"):
+                if excess <= 0:
+                    break
+                evict.append((old_key,))
+                excess -= size
+            conn.executemany("DELETE FROM entries WHERE key = ?", evict)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+async def cached(key: str, compute, ttl: int = DEFAULT_TTL):
+    """
+    Return the result of `await compute()` for `key`, computed by any worker
+    since the last invoice write, computing and storing it on a miss.
+    """
+    versioned_key = f"{key}@{await asyncio.to_thread(generation)}"
+    value = await asyncio.to_thread(get, versioned_key)
+    if value is None:
+        value = await compute()
+        await asyncio.to_thread(put, versioned_key, value, ttl)
+    return value
+
+
+def acquire_lease(name: str, seconds: int) -> bool:
+    """Take (or renew) the named lease unless another live worker holds it."""
+    conn = _connection()
+    now = time.time()
+    rows = conn.execute(
+        "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+        "ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+        "WHERE leases.expires_at <= ? OR leases.holder = excluded.holder RETURNING holder",
+        (name, _holder(), now + seconds, now)
+    ).fetchall()
+    return bool(rows)
+
+
+def release_lease(name: str):
+    """Give up the named lease if this worker holds it."""
+    _connection().execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, _holder()))
+
+
+def record_change(event_type: str, payload: str, name: str = "invoices"):
+    """
+    Bump the data generation and log a change feed event for the other
+    workers, in one transaction. Returns (new generation, event id).
+    """
+    conn = _connection()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        generation = conn.execute(
+            "INSERT INTO generations (name, value) VALUES (?, 1) "
+            "ON CONFLICT (name) DO UPDATE SET value = value + 1 RETURNING value",
+            (name,)
+        ).fetchall()[0][0]
+        event_id = conn.execute(
+            "INSERT INTO events (origin, generation, event_type, payload, created_at) VALUES (?, ?, ?, ?, ?)",
+            (os.getpid(), generation, event_type, payload, now)
+        ).lastrowid
+        conn.execute("DELETE FROM events WHERE created_at < ?", (now - EVENT_RETENTION,))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return generation, event_id
+
+
+def last_event_id() -> int:
+    return _connection().execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+
+def changes_since(generation: int):
+    """(generation, event_type, payload) of every event, from any worker, after `generation`."""
+    return _connection().execute(
+        "SELECT generation, event_type, payload FROM events WHERE generation > ? ORDER BY generation",
+        (generation,)
+    ).fetchall()
+
+
+def events_since(event_id: int):
+    """(id, event_type, payload) of the events other workers logged after `event_id`."""
+    return _connection().execute(
+        "SELECT id, event_type, payload FROM events WHERE id > ? AND origin != ? ORDER BY id",
+        (event_id, os.getpid())
+    ).fetchall()
@@ -0,0 +1,152 @@
+import asyncio
+import json
+import logging
+import os
+from pathlib import Path
+from typing import List, Optional
+from xml.sax.saxutils import escape
+
+import httpx
+from pydantic import BaseModel
+
+"""
+This module holds the registry of Tally gateways and companies and sends
+requests to them. Every (gateway, company) pair is a target; requests to a
+target carry its company as SVCURRENTCOMPANY, so they no longer depend on
+whichever company is active in Tally. Each gateway has its own connection
+pool and concurrency limit, and `fan_out` queries all targets at once, so
+a group view takes as long as the slowest company rather than the sum.
+
+The registry is read from TALLY_TARGETS (JSON) or TALLY_TARGETS_FILE:
+
+    [{"name": "ho", "url": "http://10.0.0.5:9000/", "max_concurrency": 1,
+      "companies": ["Sri Balaji Traders", "Balaji Logistics"]}]
+
+Without it, a single gateway at TALLY_URL queries the active company.
+"""
+
+DEFAULT_TALLY_URL = os.getenv("TALLY_URL", "http://100.83.110.70:9000/")
+REQUEST_TIMEOUT = 15  # seconds
+
+logger = logging.getLogger(__name__)
+
+
+class TallyGateway(BaseModel):
+    name: str
+    url: str
+    # Tally answers requests one at a time; more would only queue inside Tally
+    max_concurrency: int = 1
+    companies: List[str] = []
+
+
+class TallyTarget(BaseModel):
+    name: str
+    gateway: str
+    url: str
+    company: Optional[str] = None
+
+
+def load_gateways():
+    """Read the gateway registry from the environment."""
+    raw = os.getenv("TALLY_TARGETS")
+    path = os.getenv("TALLY_TARGETS_FILE")
+    if path:
+        raw = Path(path).read_text()
+    if not raw:
+        return [TallyGateway(name="default", url=DEFAULT_TALLY_URL)]
+    return [TallyGateway(**gateway) for gateway in json.loads(raw)]
+
+
+def build_targets(gateways):
+    """One target per configured company, or per gateway when it lists none."""
+    targets = {}
+    for gateway in gateways:
+        for company in gateway.companies or [None]:
+            name = f"{gateway.name}/{company}" if company else gateway.name
+            targets[name] = TallyTarget(name=name, gateway=gateway.name, url=gateway.url, company=company)
+    return targets
+
+
+GATEWAYS = {gateway.name: gateway for gateway in load_gateways()}
+TARGETS = build_targets(GATEWAYS.values())
+
+_clients = {}
+_semaphores = {}
+
+
+class UnknownTarget(KeyError):
+    """Raised when a request names a target that is not configured."""
+
+
+def get_targets(name: str = None):
+    """All targets, or only the named one."""
+    if name is None:
+        return list(TARGETS.values())
+    if name not in TARGETS:
+        raise UnknownTarget(name)
+    return [TARGETS[name]]
+
+
+def gateway_targets():
+    """One target per gateway, without a company (e.g. to list its companies)."""
+    return [
+        TallyTarget(name=gateway.name, gateway=gateway.name, url=gateway.url)
+        for gateway in GATEWAYS.values()
+    ]
+
+
+def with_company(xml: str, company: Optional[str]) -> str:
+    """Add SVCURRENTCOMPANY to the request's static variables."""
+    if not company:
+        return xml
+    variable = f"<SVCURRENTCOMPANY>{escape(company)}</SVCURRENTCOMPANY>"
+    if "<STATICVARIABLES>" in xml:
+        return xml.replace("<STATICVARIABLES>", f"<STATICVARIABLES>{variable}", 1)
+    return xml.replace("<DESC>", f"<DESC><STATICVARIABLES>{variable}</STATICVARIABLES>", 1)
+
+
+def _client(gateway: TallyGateway) -> httpx.AsyncClient:
+    if gateway.name not in _clients:
+        limit = gateway.max_concurrency
+        _clients[gateway.name] = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=limit, max_keepalive_connections=limit),
+            headers={"Content-Type": "text/xml"},
+        )
+        _semaphores[gateway.name] = asyncio.Semaphore(limit)
+    return _clients[gateway.name]
+
+
+async def post(target: TallyTarget, xml: str, timeout: float = REQUEST_TIMEOUT) -> httpx.Response:
+    """Send a request to one target, waiting for a free slot on its gateway."""
+    gateway = GATEWAYS[target.gateway]
+    client = _client(gateway)
+    async with _semaphores[gateway.name]:
+        response = await client.post(target.url, content=with_company(xml, target.company), timeout=timeout)
+    response.raise_for_status()
+    return response
+
+
+async def fan_out(targets, xml: str, parse, timeout: float = REQUEST_TIMEOUT):
+    """
+    Send `xml` to every target concurrently and parse each response with
+    `parse` (in a worker thread). Returns one labelled result per target;
+    a failing target is reported with its error instead of failing the rest.
+    """
+    async def run(target):
+        label = {"target": target.name, "company": target.company}
+        try:
+            response = await post(target, xml, timeout)
+            return {**label, "ok": True, "result": await asyncio.to_thread(parse, response)}
+        except Exception as e:
+            logger.error(f"Tally target {target.name} failed: {e}")
+            return {**label, "ok": False, "error": str(e)}
+
+    return await asyncio.gather(*(run(target) for target in targets))
+
+
+async def close_clients():
+    """Close the gateway connection pools."""
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
+    _semaphores.clear()
@@ -1,46 +1,70 @@
-import pandas as pd
+from __future__ import annotations
+
+import asyncio
+import time
+from datetime import date
+from typing import TYPE_CHECKING
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func
 from sqlalchemy.future import select
-from models.invoice import Invoice
-from prophet import Prophet
+from services.partitioning import invoice_source
+from statistics.snapshot import SNAPSHOT_ENABLED, current as current_snapshot
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 """
 This module contains functions to perform various analytics on invoices.
 It includes functions to load invoices from the database, calculate revenue over different time periods,
 and forecast future sales using the Prophet library.
+pandas, Prophet and the forecasting engines are imported on first use so
+importing this module (and the routers) stays cheap.
+With ANALYTICS_SNAPSHOT=1 the revenue and top-item functions read the
+in-memory invoice snapshot (statistics/snapshot.py) instead of the database.
 """
-async def load_invoices_as_df(session: AsyncSession):
-    """Load invoices from the database and convert to DataFrame."""
-    result = await session.execute(select(Invoice))
-    records = result.scalars().all()
-    df = pd.DataFrame([r.__dict__ for r in records])
+async def load_invoices_as_df(session: AsyncSession, from_date: date = None, to_date: date = None):
+    """Load invoices, optionally within a date range, and convert to DataFrame."""
+    import pandas as pd
+    source = await invoice_source(session, from_date, to_date)
+    query = select(*source)
+    if from_date:
+        query = query.where(source.invoice_date >= from_date)
+    if to_date:
+        query = query.where(source.invoice_date <= to_date)
+    result = await session.execute(query)
+    df = pd.DataFrame(result.all(), columns=list(result.keys()))
     if df.empty:
         return df
-    df.drop(columns=["_sa_instance_state"], inplace=True)
     df["invoice_date"] = pd.to_datetime(df["invoice_date"])
     return df
 
-async def get_monthly_revenue(session: AsyncSession):
+async def get_monthly_revenue(session: AsyncSession, from_date: date = None, to_date: date = None):
     """Get monthly revenue from invoices."""
-    df = await load_invoices_as_df(session)
+    if SNAPSHOT_ENABLED:
+        return (await current_snapshot(session)).revenue("monthly", from_date, to_date)
+    df = await load_invoices_as_df(session, from_date, to_date)
     if df.empty:
         return {}
     df.set_index("invoice_date", inplace=True)
     monthly = df.resample("M")["amount"].sum()
     return monthly.to_dict()
 
-async def get_quarterly_revenue(session: AsyncSession):
+async def get_quarterly_revenue(session: AsyncSession, from_date: date = None, to_date: date = None):
     """Get quarterly revenue from invoices."""
-    df = await load_invoices_as_df(session)
+    if SNAPSHOT_ENABLED:
+        return (await current_snapshot(session)).revenue("quarterly", from_date, to_date)
+    df = await load_invoices_as_df(session, from_date, to_date)
     if df.empty:
         return {}
     df.set_index("invoice_date", inplace=True)
     quarterly = df.resample("Q")["amount"].sum()
     return quarterly.to_dict()
 
-async def get_weekly_revenue(session: AsyncSession):
+async def get_weekly_revenue(session: AsyncSession, from_date: date = None, to_date: date = None):
     """Get weekly revenue from invoices."""
-    df = await load_invoices_as_df(session)
+    if SNAPSHOT_ENABLED:
+        return (await current_snapshot(session)).revenue("weekly", from_date, to_date)
+    df = await load_invoices_as_df(session, from_date, to_date)
     if df.empty:
         return {}
     df.set_index("invoice_date",inplace=True)
@@ -48,33 +72,56 @@ async def get_weekly_revenue(session: AsyncSession):
     return weekly.to_dict()
 
 
-async def top_sold_items(session):
+async def top_sold_items(session, from_date: date = None, to_date: date = None):
     """Get top 5 sold items from invoices."""
-    df = await load_invoices_as_df(session)
+    if SNAPSHOT_ENABLED:
+        return (await current_snapshot(session)).top_items("count", 5, from_date, to_date)
+    df = await load_invoices_as_df(session, from_date, to_date)
+    if df.empty:
+        return {}
     return df["description"].value_counts().head(5).to_dict()
 
-async def top_revenue_items(session):
+async def top_revenue_items(session, from_date: date = None, to_date: date = None):
     """Get top 5 products by revenue from invoices."""
-    df = await load_invoices_as_df(session)
+    if SNAPSHOT_ENABLED:
+        return (await current_snapshot(session)).top_items("revenue", 5, from_date, to_date)
+    df = await load_invoices_as_df(session, from_date, to_date)
+    if df.empty:
+        return {}
     revenue = df.groupby("description")["amount"].sum().sort_values(ascending=False)
     return revenue.head(5).to_dict()
 
 async def get_invoice_date_amount_df(session):
-    """Get invoice date and amount as DataFrame."""
-    result = await session.execute(select(Invoice))
-    data = result.scalars().all()
-    if not data:
+    """
+    Get the daily sales total as a ds/y DataFrame.
+    Invoices are summed per day in the database and days without sales are
+    filled with 0, so models see one row per calendar day.
+    """
+    import pandas as pd
+    if SNAPSHOT_ENABLED:
+        first_day, totals = (await current_snapshot(session)).daily_totals()
+        if not len(totals):
+            return pd.DataFrame()
+        return pd.DataFrame({"ds": pd.date_range(first_day, periods=len(totals), freq="D"), "y": totals})
+    source = await invoice_source(session)
+    result = await session.execute(
+        select(source.invoice_date, func.sum(source.amount))
+        .group_by(source.invoice_date)
+        .order_by(source.invoice_date)
+    )
+    rows = result.all()
+    if not rows:
         return pd.DataFrame()
-    df = pd.DataFrame([inv.__dict__ for inv in data])
-    df.drop(columns=["_sa_instance_state"], inplace=True)
-    df = df[["invoice_date", "amount"]].rename(columns={"invoice_date": "ds", "amount": "y"})
-    df["ds"] = pd.to_datetime(df["ds"])
-    return df
+    daily = pd.Series(
+        [float(amount) for _, amount in rows],
+        index=pd.to_datetime([invoice_date for invoice_date, _ in rows]),
+    )
+    daily = daily.resample("D").sum()
+    return pd.DataFrame({"ds": daily.index, "y": daily.to_numpy()})
 
-async def forecast(df: pd.DataFrame, days: int):
+def _prophet_forecast(df: pd.DataFrame, days: int):
     """Forecast sales using Prophet."""
-    if df.empty:
-        return {"error": "No data available"}
+    from prophet import Prophet
     model = Prophet()
     model.fit(df)
     future = model.make_future_dataframe(periods=days)
@@ -82,6 +129,59 @@ async def forecast(df: pd.DataFrame, days: int):
     result = forecast[["ds", "yhat"]].tail(days)
     return result.to_dict(orient="records")
 
+async def forecast(df: pd.DataFrame, days: int, engine: str = "prophet"):
+    """Forecast sales with the requested engine ("prophet" or "fast")."""
+    if df.empty:
+        return {"error": "No data available"}
+    if engine == "fast":
+        from statistics.fast_forecast import fast_forecast
+        return fast_forecast(df, days)
+    # Fitting Prophet takes seconds; keep it off the event loop
+    from statistics.workers import get_process_pool
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(), _prophet_forecast, df, days)
 
+def _timed_forecast(train: pd.DataFrame, days: int, engine: str):
+    """Fit one engine and forecast; runs in a worker process."""
+    started = time.perf_counter()
+    if engine == "fast":
+        from statistics.fast_forecast import fast_forecast
+        predicted = fast_forecast(train, days)
+    else:
+        predicted = _prophet_forecast(train, days)
+    return predicted, time.perf_counter() - started
 
+async def compare_engines(df: pd.DataFrame, days: int):
+    """
+    Hold out the last `days` days of history, forecast them with every engine
+    and report the error against the actual daily totals and the fit time.
+    Both engines are fitted in parallel in the shared process pool.
+    """
+    import pandas as pd
+    from statistics.fast_forecast import to_daily_series
+    from statistics.workers import get_process_pool
+    if df.empty:
+        return {"error": "No data available"}
+    cutoff = df["ds"].max() - pd.Timedelta(days=days)
+    train = df[df["ds"] <= cutoff]
+    if train.empty:
+        return {"error": "Not enough history for the requested horizon"}
+    actual = to_daily_series(df).loc[cutoff + pd.Timedelta(days=1):]
 
+    engines = ("fast", "prophet")
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    results = await asyncio.gather(*(
+        loop.run_in_executor(pool, _timed_forecast, train, days, engine) for engine in engines
+    ))
+    report = {}
+    for engine, (predicted, elapsed) in zip(engines, results):
+        yhat = pd.DataFrame(predicted).set_index("ds")["yhat"].reindex(actual.index)
+        errors = (actual - yhat).abs()
+        nonzero = actual != 0
+        report[engine] = {
+            "mae": float(errors.mean()),
+            "mape": float((errors[nonzero] / actual[nonzero]).mean() * 100) if nonzero.any() else None,
+            "fit_seconds": elapsed,
+        }
+    return {"horizon": days, "engines": report}
@@ -0,0 +1,180 @@
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from statistics.fast_forecast import SEASON_LENGTH, holt_winters_fit, holt_winters_predict, to_daily_series
+from statistics.workers import get_process_pool
+
+"""
+This module backtests the forecasting configurations with rolling-origin
+cross-validation. Cutoffs are placed every `period` days, starting once
+`initial` days of history are available; at each cutoff every
+configuration is fitted on the history up to the cutoff and scored on the
+next `horizon` days. Folds run in parallel in the shared process pool.
+The report gives MAE and MAPE for each day of the horizon and the fit time
+of every configuration.
+
+    python -m statistics.backtest --initial 180 --period 30 --horizon 30
+"""
+
+
+def _fit_fast(train: pd.Series, horizon: int) -> np.ndarray:
+    return holt_winters_predict(holt_winters_fit(train.to_numpy()), horizon)
+
+
+def _fit_prophet(train: pd.Series, horizon: int) -> np.ndarray:
+    # Same configuration as the stored model in model_store
+    from prophet import Prophet
+    model = Prophet()
+    model.fit(pd.DataFrame({"ds": train.index, "y": train.to_numpy()}))
+    future = pd.DataFrame({"ds": pd.date_range(train.index[-1] + pd.Timedelta(days=1), periods=horizon, freq="D")})
+    return model.predict(future)["yhat"].to_numpy()
+
+
+def _fit_seasonal_naive(train: pd.Series, horizon: int) -> np.ndarray:
+    # Baseline: repeat the last week
+    last_week = train.to_numpy()[-SEASON_LENGTH:]
+    return np.resize(last_week, horizon)
+
+
+CONFIGURATIONS = {
+    "fast": _fit_fast,
+    "prophet": _fit_prophet,
+    "seasonal_naive": _fit_seasonal_naive,
+}
+
+
+def rolling_cutoffs(index: pd.DatetimeIndex, initial: int, period: int, horizon: int, max_folds: int = None):
+    """
+    Cutoff dates from the latest one that leaves a full horizon, going back
+    every `period` days while `initial` days of history remain before it.
+    """
+    first_allowed = index[0] + pd.Timedelta(days=initial - 1)
+    cutoff = index[-1] - pd.Timedelta(days=horizon)
+    cutoffs = []
+    while cutoff >= first_allowed and (max_folds is None or len(cutoffs) < max_folds):
+        cutoffs.append(cutoff)
+        cutoff -= pd.Timedelta(days=period)
+    return sorted(cutoffs)
+
+
+def run_fold(config: str, daily: pd.Series, cutoff: pd.Timestamp, horizon: int):
+    """Fit one configuration at one cutoff and score it. Runs inside a worker process."""
+    train = daily.loc[:cutoff]
+    actual = daily.loc[cutoff + pd.Timedelta(days=1):].to_numpy()[:horizon]
+    started = time.perf_counter()
+    try:
+        predicted = CONFIGURATIONS[config](train, horizon)
+    except Exception as e:
+        return {"config": config, "cutoff": cutoff.date().isoformat(), "error": str(e)}
+    return {
+        "config": config,
+        "cutoff": cutoff.date().isoformat(),
+        "fit_seconds": time.perf_counter() - started,
+        "actual": actual.tolist(),
+        "predicted": np.asarray(predicted, dtype=float).tolist(),
+    }
+
+
+def summarize(folds, horizon: int):
+    """Aggregate fold results into per-horizon MAE/MAPE and fit times per configuration."""
+    report = {}
+    for config in dict.fromkeys(fold["config"] for fold in folds):
+        scored = [fold for fold in folds if fold["config"] == config and "error" not in fold]
+        failed = [fold for fold in folds if fold["config"] == config and "error" in fold]
+        entry = {"folds": len(scored), "failed_folds": len(failed)}
+        if failed:
+            entry["errors"] = sorted({fold["error"] for fold in failed})
+        if scored:
+            actual = np.array([fold["actual"] for fold in scored])
+            errors = np.abs(actual - np.array([fold["predicted"] for fold in scored]))
+            # Days without sales have no percentage error
+            has_sales = actual != 0
+            ape = np.divide(errors, np.abs(actual), out=np.full_like(errors, np.nan), where=has_sales) * 100
+            fit_seconds = np.array([fold["fit_seconds"] for fold in scored])
+            entry.update({
+                "mae": float(errors.mean()),
+                "mape": float(np.nanmean(ape)) if has_sales.any() else None,
+                "fit_seconds_mean": float(fit_seconds.mean()),
+                "fit_seconds_max": float(fit_seconds.max()),
+                "per_horizon": [
+                    {
+                        "day": day + 1,
+                        "mae": float(errors[:, day].mean()),
+                        "mape": float(np.nanmean(ape[:, day])) if has_sales[:, day].any() else None,
+                    }
+                    for day in range(horizon)
+                ],
+            })
+        report[config] = entry
+    return report
+
+
+async def run_backtest(df: pd.DataFrame, initial: int, period: int, horizon: int,
+                       configs=None, max_folds: int = None):
+    """Backtest `configs` (all by default) on a ds/y frame of daily sales."""
+    if df.empty:
+        return {"error": "No data available"}
+    daily = to_daily_series(df)
+    cutoffs = rolling_cutoffs(daily.index, initial, period, horizon, max_folds)
+    if not cutoffs:
+        return {"error": "Not enough history for the requested initial window and horizon"}
+
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    configs = list(configs or CONFIGURATIONS)
+    started = time.perf_counter()
+    folds = await asyncio.gather(*(
+        loop.run_in_executor(pool, run_fold, config, daily, cutoff, horizon)
+        for config in configs for cutoff in cutoffs
+    ))
+    return {
+        "initial": initial,
+        "period": period,
+        "horizon": horizon,
+        "history_days": len(daily),
+        "cutoffs": [cutoff.date().isoformat() for cutoff in cutoffs],
+        "wall_seconds": time.perf_counter() - started,
+        "configs": summarize(folds, horizon),
+    }
+
+
+async def _backtest_database(args):
+    from database import AsyncSessionLocal
+    from statistics.analytics import get_invoice_date_amount_df
+    async with AsyncSessionLocal() as session:
+        df = await get_invoice_date_amount_df(session)
+    return await run_backtest(df, args.initial, args.period, args.horizon, args.configs, args.max_folds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rolling-origin backtest of the sales forecasting configurations.")
+    parser.add_argument("--initial", type=int, default=180, help="Days of history before the first cutoff")
+    parser.add_argument("--period", type=int, default=30, help="Days between cutoffs")
+    parser.add_argument("--horizon", type=int, default=30, help="Days forecast at each cutoff")
+    parser.add_argument("--configs", nargs="+", choices=list(CONFIGURATIONS), help="Configurations to test (all by default)")
+    parser.add_argument("--max-folds", type=int, help="Only use the latest N cutoffs")
+    parser.add_argument("--json", help="Also write the full report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(_backtest_database(args))
+    if "error" in report:
+        raise SystemExit(report["error"])
+    print(f"{len(report['cutoffs'])} folds, horizon {report['horizon']} days, {report['wall_seconds']:.1f}s wall clock")
+    for config, entry in report["configs"].items():
+        if not entry["folds"]:
+            print(f"{config:<16} all folds failed: {'; '.join(entry['errors'])}")
+            continue
+        mape = f"{entry['mape']:.1f}%" if entry["mape"] is not None else "n/a"
+        print(f"{config:<16} MAE {entry['mae']:.2f}  MAPE {mape}  fit {entry['fit_seconds_mean']:.3f}s mean")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+"""
+This module contains a lightweight forecasting engine built on NumPy.
+It fits an additive Holt-Winters model (damped trend, weekly seasonality)
+on the daily sales series, searching the smoothing parameters over a small
+grid in a single vectorized pass, so a fit takes milliseconds instead of
+the seconds Prophet needs.
+"""
+
+SEASON_LENGTH = 7
+
+# Smoothing parameter grid searched during fitting
+ALPHAS = np.array([0.05, 0.1, 0.2, 0.3, 0.5, 0.8])
+BETAS = np.array([0.0, 0.01, 0.05, 0.1])
+GAMMAS = np.array([0.0, 0.05, 0.1, 0.3])
+PHIS = np.array([0.8, 0.9, 0.98])
+
+
+def to_daily_series(df: pd.DataFrame) -> pd.Series:
+    """Aggregate a ds/y frame to one total per day, filling missing days with 0."""
+    return df.groupby("ds")["y"].sum().resample("D").sum()
+
+
+def _initial_state(y: np.ndarray, m: int):
+    """Estimate the initial level, trend and seasonal components."""
+    if len(y) < 2 * m:
+        return y[0], 0.0, np.zeros(m)
+    level = y[:m].mean()
+    trend = (y[m:2 * m].mean() - level) / m
+    season = y[:m] - level
+    return level, trend, season
+
+
+def holt_winters_fit(y: np.ndarray, m: int = SEASON_LENGTH):
+    """
+    Fit additive damped Holt-Winters on every point of the parameter grid at
+    once and return the final state of the combination with the lowest
+    one-step-ahead squared error.
+    """
+    y = np.asarray(y, dtype=float)
+    alpha, beta, gamma, phi = (a.ravel() for a in np.meshgrid(ALPHAS, BETAS, GAMMAS, PHIS, indexing="ij"))
+    if len(y) < 2 * m:
+        # Not enough history to estimate a weekly pattern
+        gamma = np.zeros_like(gamma)
+
+    level0, trend0, season0 = _initial_state(y, m)
+    grid = len(alpha)
+    level = np.full(grid, level0)
+    trend = np.full(grid, trend0)
+    season = np.tile(season0, (grid, 1))
+    sse = np.zeros(grid)
+
+    for t, value in enumerate(y):
+        idx = t % m
+        s = season[:, idx]
+        error = value - (level + phi * trend + s)
+        sse += error ** 2
+        new_level = alpha * (value - s) + (1 - alpha) * (level + phi * trend)
+        trend = beta * (new_level - level) + (1 - beta) * phi * trend
+        season[:, idx] = gamma * (value - new_level) + (1 - gamma) * s
+        level = new_level
+
+    best = int(np.argmin(sse))
+    return {
+        "level": level[best],
+        "trend": trend[best],
+        "season": season[best],
+        "phi": phi[best],
+        "n": len(y),
+        "m": m,
+    }
+
+
+def holt_winters_predict(state: dict, horizon: int) -> np.ndarray:
+    """Forecast `horizon` steps ahead from a fitted Holt-Winters state."""
+    steps = np.arange(1, horizon + 1)
+    damped = np.cumsum(state["phi"] ** steps)
+    season_idx = (state["n"] + steps - 1) % state["m"]
+    return state["level"] + damped * state["trend"] + state["season"][season_idx]
+
+
+def fast_forecast(df: pd.DataFrame, days: int):
+    """Forecast daily sales with Holt-Winters, returning ds/yhat records."""
+    if df.empty:
+        return {"error": "No data available"}
+    daily = to_daily_series(df)
+    state = holt_winters_fit(daily.to_numpy())
+    future = pd.date_range(daily.index[-1] + pd.Timedelta(days=1), periods=days, freq="D")
+    result = pd.DataFrame({"ds": future, "yhat": holt_winters_predict(state, days)})
+    return result.to_dict(orient="records")
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from database import AsyncSessionLocal
+from services import shared_cache
+from statistics.analytics import get_invoice_date_amount_df
+
+"""
+This module keeps the fitted Prophet sales model out of the request path.
+The model is refitted on a schedule in the background, serialized to disk
+with Prophet's JSON serialization and loaded at startup, so prediction
+routes only ever call `predict`. The model file is read on the first
+prediction rather than at import time, and Prophet is imported on first use.
+With several server workers, a lease in the shared cache lets only one of
+them refit; the others reload the model file when it changes.
+"""
+
+MODEL_DIR = Path(os.getenv("MODEL_DIR", "model_store"))
+MODEL_PATH = MODEL_DIR / "sales_prophet.json"
+REFIT_HOUR = int(os.getenv("MODEL_REFIT_HOUR", "2"))  # local hour of the nightly refit
+REFIT_LEASE_SECONDS = 1800  # longest a refit may take before another worker may start one
+MIN_HISTORY_DAYS = 2  # Prophet cannot fit fewer days
+
+logger = logging.getLogger(__name__)
+
+_model = None
+_model_mtime = None
+_refit_lock = asyncio.Lock()
+
+
+class ModelNotReady(Exception):
+    """Raised when no fitted model is available yet."""
+
+
+def fit_model(df):
+    """Fit a Prophet model on the daily sales series."""
+    from prophet import Prophet
+    model = Prophet()
+    model.fit(df)
+    return model
+
+
+def save_model(model):
+    """Serialize the model to disk, replacing the previous one atomically."""
+    from prophet.serialize import model_to_json
+    MODEL_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = MODEL_PATH.with_suffix(".tmp")
+    tmp_path.write_text(model_to_json(model))
+    os.replace(tmp_path, MODEL_PATH)
+
+
+def model_version():
+    """Modification time of the model file, or None if there is no model yet."""
+    try:
+        return MODEL_PATH.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def load_model():
+    """Load the serialized model from disk, if one exists."""
+    global _model, _model_mtime
+    version = model_version()
+    if version is None:
+        return None
+    from prophet.serialize import model_from_json
+    try:
+        _model = model_from_json(MODEL_PATH.read_text())
+        _model_mtime = version
+    except Exception as e:
+        logger.error(f"Failed to load forecast model: {e}")
+        return None
+    return _model
+
+
+async def refit():
+    """Fit a new model on the current invoice history and persist it."""
+    global _model, _model_mtime
+    async with _refit_lock:
+        if not await asyncio.to_thread(shared_cache.acquire_lease, "model_refit", REFIT_LEASE_SECONDS):
+            logger.info("Skipping forecast model refit: another worker is refitting")
+            return None
+        try:
+            async with AsyncSessionLocal() as session:
+                df = await get_invoice_date_amount_df(session)
+            if len(df) < MIN_HISTORY_DAYS:
+                logger.warning(f"Skipping forecast model refit: not enough invoice history ({len(df)} days)")
+                return None
+            model = await asyncio.to_thread(fit_model, df)
+            await asyncio.to_thread(save_model, model)
+            _model, _model_mtime = model, model_version()
+            logger.info(f"Forecast model refitted on {len(df)} days of history")
+            return model
+        finally:
+            await asyncio.to_thread(shared_cache.release_lease, "model_refit")
+
+
+def _seconds_until_next_refit(now: datetime) -> float:
+    next_run = now.replace(hour=REFIT_HOUR, minute=0, second=0, microsecond=0)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+
+async def refit_initial():
+    """Background task fitting a first model at startup."""
+    try:
+        await refit()
+    except Exception as e:
+        logger.error(f"Initial forecast model refit failed: {e}")
+
+
+async def refit_nightly():
+    """Background task refitting the model once a day at REFIT_HOUR."""
+    while True:
+        await asyncio.sleep(_seconds_until_next_refit(datetime.now()))
+        try:
+            await refit()
+        except Exception as e:
+            logger.error(f"Nightly forecast model refit failed: {e}")
+
+
+def predict(days: int):
+    """Forecast the next `days` days with the stored model."""
+    import pandas as pd
+    model = _model
+    # Another worker may have refitted and replaced the file
+    if model is None or model_version() != _model_mtime:
+        model = load_model() or model
+    if model is None:
+        raise ModelNotReady("Forecast model is not trained yet")
+    last_day = model.history["ds"].max()
+    future = pd.DataFrame({"ds": pd.date_range(last_day + pd.Timedelta(days=1), periods=days, freq="D")})
+    forecast = model.predict(future)
+    return forecast[["ds", "yhat"]].to_dict(orient="records")
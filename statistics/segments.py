@@ -0,0 +1,121 @@
+import asyncio
+import json
+from datetime import date, timedelta
+
+import pandas as pd
+from prophet import Prophet
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from services.partitioning import invoice_source
+from statistics.fast_forecast import fast_forecast, to_daily_series
+from statistics.workers import get_process_pool
+
+"""
+This module forecasts sales per segment (HSN/SAC code, company or item).
+Invoices are grouped per segment and day in the database, then one model
+per segment is fitted in the shared process pool. Every segment's history
+is extended with zero-sales days up to the last sale of any segment, so
+all segments forecast the same window, even those that stopped selling.
+Results are yielded as soon as each segment finishes.
+"""
+
+MIN_SEGMENT_DAYS = 2  # below this a segment is skipped entirely
+
+
+async def load_segment_series(session: AsyncSession, dimension: str, top: int = None):
+    """
+    Load the daily sales total of every segment of `dimension`, largest
+    segments first. With `top`, only the `top` segments by revenue are kept.
+    """
+    source = await invoice_source(session)
+    column = getattr(source, dimension)
+    query = (
+        select(column, source.invoice_date, func.sum(source.amount))
+        .group_by(column, source.invoice_date)
+        .order_by(column, source.invoice_date)
+    )
+    if top:
+        top_segments = (
+            select(column)
+            .group_by(column)
+            .order_by(func.sum(source.amount).desc())
+            .limit(top)
+        )
+        query = query.where(column.in_(top_segments))
+
+    result = await session.execute(query)
+    series = {}
+    for segment, invoice_date, amount in result.all():
+        dates, amounts = series.setdefault(segment, ([], []))
+        dates.append(invoice_date)
+        amounts.append(float(amount))
+    return dict(sorted(series.items(), key=lambda item: sum(item[1][1]), reverse=True))
+
+
+async def last_sale_date(session: AsyncSession):
+    """Date of the latest invoice of any segment, or None without invoices."""
+    source = await invoice_source(session)
+    result = await session.execute(select(func.max(source.invoice_date)))
+    return result.scalar()
+
+
+def forecast_segment(segment: str, dates: list, amounts: list, days: int, engine: str, min_history: int,
+                     history_end: date):
+    """
+    Fit and forecast a single segment over the `days` days after
+    `history_end`. Runs inside a worker process. Segments with fewer than
+    `min_history` days of sales fall back to the fast engine instead of Prophet.
+    """
+    if len(dates) < MIN_SEGMENT_DAYS:
+        return {"segment": segment, "skipped": "Not enough history", "history_days": len(dates)}
+
+    daily = to_daily_series(pd.DataFrame({"ds": pd.to_datetime(dates), "y": amounts}))
+    # Days after the segment's last sale until the common end had no sales
+    daily = daily.reindex(pd.date_range(daily.index[0], pd.Timestamp(history_end), freq="D"), fill_value=0)
+    df = pd.DataFrame({"ds": daily.index, "y": daily.to_numpy()})
+    used_engine = engine
+    if engine == "prophet" and len(dates) < min_history:
+        used_engine = "fast"
+
+    try:
+        if used_engine == "fast":
+            records = fast_forecast(df, days)
+        else:
+            model = Prophet()
+            model.fit(df)
+            future = pd.DataFrame({"ds": pd.date_range(daily.index[-1] + pd.Timedelta(days=1), periods=days, freq="D")})
+            records = model.predict(future)[["ds", "yhat"]].to_dict(orient="records")
+    except Exception as e:
+        return {"segment": segment, "error": str(e), "history_days": len(dates)}
+
+    return {
+        "segment": segment,
+        "engine": used_engine,
+        "history_days": len(dates),
+        "last_sale": max(dates).isoformat(),
+        "forecast_from": (history_end + timedelta(days=1)).isoformat(),
+        "forecast_to": (history_end + timedelta(days=days)).isoformat(),
+        "forecast": [{"ds": r["ds"].isoformat(), "yhat": float(r["yhat"])} for r in records],
+    }
+
+
+async def stream_segment_forecasts(series: dict, days: int, engine: str, min_history: int, history_end: date):
+    """
+    Fit every segment in the process pool and yield NDJSON lines as they
+    finish, each forecasting the `days` days after `history_end`.
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    futures = [
+        loop.run_in_executor(pool, forecast_segment, segment, dates, amounts, days, engine, min_history, history_end)
+        for segment, (dates, amounts) in series.items()
+    ]
+    try:
+        for finished in asyncio.as_completed(futures):
+            yield json.dumps(await finished) + "\n"
+    finally:
+        # Client went away: drop the segments not started yet
+        for future in futures:
+            future.cancel()
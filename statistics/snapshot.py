@@ -0,0 +1,391 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import date
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from models.invoice import InvoiceStatus
+from services import shared_cache
+from services.partitioning import invoice_source
+
+"""
+This module keeps an optional in-memory, columnar copy of the invoice
+fields the analytics read (invoice_date, amount, quantity, status,
+description, hsn_sac), so revenue and top-item queries are vectorized
+NumPy operations instead of a database round trip and a DataFrame build.
+Dates are stored as int32 day numbers, the strings as int32 codes into a
+dictionary of distinct values, and status as a uint8 code: about 37 bytes
+per invoice. Totals per day and per description are aggregated once after
+each write, so most queries only touch those small arrays. Set
+ANALYTICS_SNAPSHOT=1 to enable it.
+
+The snapshot is built once at startup and then kept up to date with the
+shared data generation (see services/shared_cache.py). New invoices are
+added from the rows the write path inserted. Updated and status-changed
+invoices are only marked stale, and re-read by id on the next read, so
+the snapshot ends up with the committed values even when two writes
+publish in a different order than they committed. Writes of other
+workers are replayed from the shared change log on the next read; the
+snapshot is only rebuilt when that log no longer covers them.
+"""
+
+SNAPSHOT_ENABLED = os.getenv("ANALYTICS_SNAPSHOT", "0").lower() in ("1", "true", "yes")
+BUILD_CHUNK = 50000  # rows fetched per round trip while building
+
+COLUMNS = ("id", "invoice_date", "amount", "quantity", "status", "description", "hsn_sac")
+ARRAYS = ("ids", "days", "amounts", "quantities", "statuses", "descriptions", "hsn_sacs")
+REFRESH_CHUNK = 5000  # stale ids re-read per query
+
+STATUSES = list(InvoiceStatus)
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+
+logger = logging.getLogger(__name__)
+
+
+class _Dictionary:
+    """Maps each distinct string to a small integer code."""
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def encode(self, values):
+        import numpy as np
+        codes = self.codes
+        for value in values:
+            if value not in codes:
+                codes[value] = len(self.values)
+                self.values.append(value)
+        return np.fromiter((codes[value] for value in values), dtype=np.int32, count=len(values))
+
+
+def _day(value: date) -> int:
+    import numpy as np
+    return int(np.datetime64(value, "D").astype(np.int64))
+
+
+class InvoiceSnapshot:
+    """
+    Columnar invoice data ordered by id. Arrays are over-allocated; only
+    the first `size` rows are in use. Per-day and per-description totals
+    are computed on first use and kept until the next write.
+    """
+
+    def __init__(self, generation: int):
+        import numpy as np
+        self.generation = generation
+        self.size = 0
+        self.ids = np.empty(0, dtype=np.int64)
+        self.days = np.empty(0, dtype=np.int32)  # days since 1970-01-01
+        self.amounts = np.empty(0, dtype=np.float64)
+        self.quantities = np.empty(0, dtype=np.float64)
+        self.statuses = np.empty(0, dtype=np.uint8)
+        self.descriptions = np.empty(0, dtype=np.int32)
+        self.hsn_sacs = np.empty(0, dtype=np.int32)
+        self.description_values = _Dictionary()
+        self.hsn_sac_values = _Dictionary()
+        self.stale = set()  # ids to re-read from the database before the next read
+        self._totals = None
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in ARRAYS)
+
+    def _column(self, name):
+        return getattr(self, name)[:self.size]
+
+    def _encode(self, rows):
+        import numpy as np
+        ids, dates, amounts, quantities, statuses, descriptions, hsn_sacs = zip(*rows)
+        return {
+            "ids": np.array(ids, dtype=np.int64),
+            "days": np.array(dates, dtype="datetime64[D]").astype(np.int32),
+            "amounts": np.array(amounts, dtype=np.float64),
+            "quantities": np.array(quantities, dtype=np.float64),
+            "statuses": np.array([STATUS_CODES[status] for status in statuses], dtype=np.uint8),
+            "descriptions": self.description_values.encode(descriptions),
+            "hsn_sacs": self.hsn_sac_values.encode(hsn_sacs),
+        }
+
+    def _positions(self, ids):
+        """Positions of `ids` in the snapshot and whether each one is present."""
+        import numpy as np
+        current = self._column("ids")
+        positions = np.searchsorted(current, ids)
+        found = positions < self.size
+        found[found] = current[positions[found]] == ids[found]
+        return positions, found
+
+    def _append(self, columns):
+        import numpy as np
+        count = len(columns["ids"])
+        if self.size + count > len(self.ids):
+            # Grow by an eighth: appends stay amortized O(1) without doubling the memory
+            capacity = self.size + count + max(self.size // 8, 1024)
+            for name in ARRAYS:
+                grown = np.empty(capacity, dtype=getattr(self, name).dtype)
+                grown[:self.size] = self._column(name)
+                setattr(self, name, grown)
+        for name in ARRAYS:
+            getattr(self, name)[self.size:self.size + count] = columns[name]
+        self.size += count
+
+    def _merge(self, columns):
+        # New ids below the highest one (rare): rebuild the arrays in id order
+        import numpy as np
+        merged = {name: np.concatenate([self._column(name), columns[name]]) for name in ARRAYS}
+        order = np.argsort(merged["ids"], kind="stable")
+        for name in ARRAYS:
+            setattr(self, name, merged[name][order])
+        self.size = len(order)
+
+    def upsert(self, rows):
+        """Insert or replace rows given as tuples in COLUMNS order."""
+        import numpy as np
+        if not rows:
+            return
+        self._totals = None
+        columns = self._encode(rows)
+        positions, found = self._positions(columns["ids"])
+        for name in ARRAYS:
+            getattr(self, name)[positions[found]] = columns[name][found]
+        new = {name: values[~found] for name, values in columns.items()}
+        if not len(new["ids"]):
+            return
+        order = np.argsort(new["ids"], kind="stable")
+        new = {name: values[order] for name, values in new.items()}
+        if self.size == 0 or new["ids"][0] > self.ids[self.size - 1]:
+            self._append(new)
+        else:
+            self._merge(new)
+
+    def insert(self, rows):
+        """Add new rows; ids already present came from a later write and are kept."""
+        import numpy as np
+        if not rows:
+            return
+        _, found = self._positions(np.array([row[0] for row in rows], dtype=np.int64))
+        self.upsert([row for row, present in zip(rows, found) if not present])
+
+    def remove(self, ids):
+        # Invoices are deleted one at a time and rarely, so rows are dropped
+        # right away rather than masked
+        import numpy as np
+        positions, found = self._positions(np.asarray(ids, dtype=np.int64))
+        if not found.any():
+            return
+        self._totals = None
+        for name in ARRAYS:
+            setattr(self, name, np.delete(self._column(name), positions[found]))
+        self.size = len(self.ids)
+
+    def _aggregates(self):
+        import numpy as np
+        if self._totals is None:
+            days = self._column("days")
+            amounts = self._column("amounts")
+            codes = self._column("descriptions")
+            first = int(days.min()) if self.size else 0
+            offsets = days - first
+            item_count = len(self.description_values.values)
+            self._totals = {
+                "first_day": first,
+                "daily_revenue": np.bincount(offsets, weights=amounts),
+                "daily_count": np.bincount(offsets),
+                "item_revenue": np.bincount(codes, weights=amounts, minlength=item_count),
+                "item_count": np.bincount(codes, minlength=item_count),
+            }
+        return self._totals
+
+    def revenue(self, period: str, from_date: date = None, to_date: date = None):
+        """
+        Revenue per week (ending Sunday), month or quarter, keyed by the
+        period end like the pandas resample results, empty periods included.
+        """
+        import numpy as np
+        totals = self._aggregates()
+        first_day = totals["first_day"]
+        start = max(_day(from_date) - first_day, 0) if from_date else 0
+        stop = _day(to_date) - first_day + 1 if to_date else len(totals["daily_count"])
+        with_sales = np.flatnonzero(totals["daily_count"][start:max(stop, start)])
+        if not len(with_sales):
+            return {}
+        start, stop = start + with_sales[0], start + with_sales[-1] + 1
+        days = np.arange(first_day + start, first_day + stop)
+        if period == "weekly":
+            # Day 0 is a Thursday, so (day + 3) // 7 counts weeks starting on Monday
+            index = (days + 3) // 7
+        else:
+            index = days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+            if period == "quarterly":
+                index //= 3
+        revenue = np.bincount(index - index[0], weights=totals["daily_revenue"][start:stop])
+        periods = np.arange(index[0], index[-1] + 1)
+        if period == "weekly":
+            ends = (periods * 7 + 3).astype("datetime64[D]")
+        else:
+            months = (periods + 1) * 3 if period == "quarterly" else periods + 1
+            ends = months.astype("datetime64[M]").astype("datetime64[D]") - np.timedelta64(1, "D")
+        return dict(zip(ends.astype("datetime64[s]").tolist(), revenue.tolist()))
+
+    def top_items(self, by: str = "count", limit: int = 5, from_date: date = None, to_date: date = None):
+        """Descriptions with the most invoices (`by="count"`) or the most revenue (`by="revenue"`)."""
+        import numpy as np
+        if from_date or to_date:
+            days = self._column("days")
+            mask = np.ones(self.size, dtype=bool)
+            if from_date:
+                mask &= days >= _day(from_date)
+            if to_date:
+                mask &= days <= _day(to_date)
+            codes = self._column("descriptions")[mask]
+            item_count = len(self.description_values.values)
+            counts = np.bincount(codes, minlength=item_count)
+            revenue = None
+            if by == "revenue":
+                revenue = np.bincount(codes, weights=self._column("amounts")[mask], minlength=item_count)
+        else:
+            totals = self._aggregates()
+            counts, revenue = totals["item_count"], totals["item_revenue"]
+        scores = revenue if by == "revenue" else counts
+        present = np.flatnonzero(counts)
+        top = present[np.argsort(-scores[present], kind="stable")][:limit]
+        values = self.description_values.values
+        return {values[code]: scores[code].item() for code in top}
+
+    def daily_totals(self):
+        """First day and the revenue of every day from there to the last invoice."""
+        import numpy as np
+        totals = self._aggregates()
+        return np.datetime64(totals["first_day"], "D"), totals["daily_revenue"]
+
+
+_snapshot = None
+_build_lock = asyncio.Lock()
+
+
+async def _build(session: AsyncSession, generation: int) -> InvoiceSnapshot:
+    started = time.perf_counter()
+    snapshot = InvoiceSnapshot(generation)
+    source = await invoice_source(session)
+    result = await session.stream(
+        select(*(getattr(source, column) for column in COLUMNS))
+        .order_by(source.id)
+        .execution_options(yield_per=BUILD_CHUNK)
+    )
+    async for rows in result.partitions():
+        snapshot.upsert(rows)
+    logger.info(
+        f"Invoice snapshot built: {snapshot.size} rows, "
+        f"{snapshot.nbytes / 1024 / 1024:.1f} MB in {time.perf_counter() - started:.2f}s"
+    )
+    return snapshot
+
+
+def _event_ids(data: dict):
+    if "invoice" in data:
+        return [data["invoice"]["id"]]
+    if "id" in data:
+        return [data["id"]]
+    return data.get("ids", [])
+
+
+def _apply_event(snapshot: InvoiceSnapshot, event_type: str, data: dict):
+    ids = _event_ids(data)
+    if event_type == "invoice.deleted":
+        snapshot.remove(ids)
+    else:
+        snapshot.stale.update(ids)
+
+
+async def _catch_up(snapshot: InvoiceSnapshot) -> bool:
+    """Replay the logged writes after the snapshot's generation; False if some are missing."""
+    changes = await asyncio.to_thread(shared_cache.changes_since, snapshot.generation)
+    for generation, event_type, payload in changes:
+        if generation <= snapshot.generation:
+            continue  # patched in locally meanwhile
+        if generation != snapshot.generation + 1:
+            return False
+        _apply_event(snapshot, event_type, json.loads(payload))
+        snapshot.generation = generation
+    return True
+
+
+async def _refresh(session: AsyncSession, snapshot: InvoiceSnapshot):
+    """Re-read the stale invoices by id; the ones no longer found are dropped."""
+    import numpy as np
+    ids = sorted(snapshot.stale)
+    snapshot.stale.clear()
+    source = await invoice_source(session)
+    for start in range(0, len(ids), REFRESH_CHUNK):
+        chunk = ids[start:start + REFRESH_CHUNK]
+        result = await session.execute(
+            select(*(getattr(source, column) for column in COLUMNS)).where(source.id.in_(chunk))
+        )
+        rows = result.all()
+        snapshot.upsert(rows)
+        missing = np.setdiff1d(np.array(chunk, dtype=np.int64), np.array([row[0] for row in rows], dtype=np.int64))
+        snapshot.remove(missing)
+
+
+async def current(session: AsyncSession) -> InvoiceSnapshot:
+    """The snapshot, brought up to date with every write first."""
+    global _snapshot
+    generation = await asyncio.to_thread(shared_cache.generation)
+    if _snapshot is None or _snapshot.generation < generation or _snapshot.stale:
+        async with _build_lock:
+            if _snapshot is not None and _snapshot.generation < generation:
+                # Writes older than the log's retention can no longer be replayed
+                if not await _catch_up(_snapshot) or _snapshot.generation < generation:
+                    _snapshot = None
+            if _snapshot is None:
+                _snapshot = await _build(session, generation)
+            elif _snapshot.stale:
+                await _refresh(session, _snapshot)
+    return _snapshot
+
+
+async def load():
+    """Build the snapshot in the background at startup."""
+    from database import AsyncSessionLocal
+    async with AsyncSessionLocal() as session:
+        await current(session)
+
+
+def _patch(generation, apply):
+    """Apply a committed local write if the snapshot has seen every write before it."""
+    global _snapshot
+    if _snapshot is None:
+        return
+    if generation is None:
+        # The write was not logged; nothing will replay it
+        _snapshot = None
+    elif generation == _snapshot.generation + 1:
+        apply(_snapshot)
+        _snapshot.generation = generation
+    # Otherwise the next read replays it from the shared change log
+
+
+def record_invoices(generation, invoices):
+    """Patch in created invoices (model instances)."""
+    _patch(generation, lambda snapshot: snapshot.insert(
+        [tuple(getattr(invoice, column) for column in COLUMNS) for invoice in invoices]
+    ))
+
+
+def record_rows(generation, rows):
+    """Patch in inserted rows given as tuples in COLUMNS order."""
+    _patch(generation, lambda snapshot: snapshot.insert(rows))
+
+
+def record_changed(generation, ids):
+    """Mark updated invoices to be re-read with their committed values."""
+    _patch(generation, lambda snapshot: snapshot.stale.update(ids))
+
+
+def record_deleted(generation, ids):
+    _patch(generation, lambda snapshot: snapshot.remove(ids))
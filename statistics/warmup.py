@@ -0,0 +1,29 @@
+import os
+import time
+import logging
+
+"""
+This module contains the optional warm-up hook for the analytics stack.
+pandas, Prophet and the cmdstan backend are imported lazily on first use;
+setting ANALYTICS_WARMUP=1 loads them in the background right after
+startup instead, so the first analytics or forecast request does not pay
+the import cost.
+"""
+
+WARMUP_ENABLED = os.getenv("ANALYTICS_WARMUP", "0").lower() in ("1", "true", "yes")
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up():
+    """Import the heavy analytics dependencies and load the stored model."""
+    started = time.perf_counter()
+    import pandas  # noqa: F401
+    from prophet import Prophet
+    from statistics import fast_forecast  # noqa: F401
+    from statistics import model_store
+
+    # Instantiating Prophet loads the cmdstan backend
+    Prophet()
+    model_store.load_model()
+    logger.info(f"Analytics warm-up finished in {time.perf_counter() - started:.2f}s")
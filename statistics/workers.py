@@ -0,0 +1,33 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+"""
+This module owns the process pool used for CPU-bound model fitting.
+The pool is created on first use and shared by every caller, so worker
+start-up is paid once per server process.
+"""
+
+MAX_WORKERS = int(os.getenv("FORECAST_WORKERS", os.cpu_count() or 1))
+
+_pool = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Return the shared process pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        # spawn avoids forking a process that is running an event loop and threads
+        _pool = ProcessPoolExecutor(
+            max_workers=MAX_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def shutdown_process_pool():
+    """Stop the shared process pool if it was started."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None